@@ -0,0 +1,37 @@
+"""
+Run the benchmark suite.
+
+    $ python -m benchmarks --filter 'negotiation.*'
+
+"""
+import argparse
+
+from benchmarks import (binary_decoding, codec_paths, debug_logging,
+                        negotiation, service_routing, support, throughput)
+
+
+COLLECTORS = [
+    negotiation.collect,
+    codec_paths.collect,
+    binary_decoding.collect,
+    debug_logging.collect,
+    throughput.collect,
+    service_routing.collect,
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run the glinda benchmark suite.')
+    parser.add_argument('--filter', default='*',
+                        help='only run benchmarks that match this glob')
+    parser.add_argument('--number', type=int, default=10,
+                        help='number of calls per measurement')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of measurements to take')
+    options = parser.parse_args()
+    support.run_benchmarks(COLLECTORS, options)
+
+
+if __name__ == '__main__':
+    main()
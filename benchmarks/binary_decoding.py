@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""
+Measure the cost of normalizing strings returned by binary loaders.
+
+Binary loaders are assumed to produce byte strings so the decoded body
+is walked by :func:`tornado.escape.recursive_unicode` unless the type is
+registered with ``native_strings=True``.  This benchmark decodes a
+nested msgpack document of roughly one megabyte both ways.
+
+    $ python -m benchmarks.binary_decoding
+
+"""
+import argparse
+import functools
+import timeit
+
+import msgpack
+
+from glinda import content
+
+from benchmarks import support
+
+
+def build_document(target_size):
+    """Build a nested document that packs to roughly `target_size` bytes."""
+    document, packed_size, index = [], 0, 0
+    while packed_size < target_size:
+        entry = {
+            'id': index,
+            'name': 'entry {0}'.format(index),
+            'tags': ['tag-{0}'.format(tag) for tag in range(5)],
+            'attributes': {
+                'nested': {'depth': 3, 'values': list(range(10))},
+                'description': 'x' * 64,
+            },
+        }
+        document.append(entry)
+        packed_size += len(msgpack.packb(entry))
+        index += 1
+    return {'entries': document}
+
+
+def make_handler(native_strings):
+    handler = content._ContentHandler('application/msgpack')
+    handler.dict_to_bytes = msgpack.packb
+    if native_strings:
+        handler.bytes_to_dict = functools.partial(msgpack.unpackb, raw=False)
+    else:
+        handler.bytes_to_dict = functools.partial(msgpack.unpackb, raw=True)
+    handler.accepts_buffer = native_strings
+    handler.native_strings = native_strings
+    return handler
+
+
+def collect(options):
+    body = msgpack.packb(build_document(1024 * 1024))
+    for label, native_strings in (('recursive_unicode', False),
+                                  ('native_strings', True)):
+        handler = make_handler(native_strings)
+        yield support.Benchmark(
+            'binary_decoding.1MB.{0}'.format(label),
+            lambda handler=handler: handler.unpack_bytes(body))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--size', type=int, default=1024 * 1024,
+                        help='approximate document size in bytes')
+    parser.add_argument('--number', type=int, default=20,
+                        help='number of decodes per measurement')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of measurements to take')
+    args = parser.parse_args()
+
+    body = msgpack.packb(build_document(args.size))
+    print('decoding {0} bytes, best of {1} x {2} decodes'.format(
+        len(body), args.repeat, args.number))
+
+    results = {}
+    for label, native_strings in (('recursive_unicode', False),
+                                  ('native_strings', True)):
+        handler = make_handler(native_strings)
+        timings = timeit.repeat(lambda: handler.unpack_bytes(body),
+                                number=args.number, repeat=args.repeat)
+        results[label] = min(timings) / args.number
+        print('{0:>20s}: {1:8.3f} ms/decode'.format(
+            label, results[label] * 1000.0))
+
+    print('{0:>20s}: {1:8.2f}x'.format(
+        'speedup', results['recursive_unicode'] / results['native_strings']))
+
+
+if __name__ == '__main__':
+    main()
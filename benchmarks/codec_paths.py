@@ -0,0 +1,64 @@
+"""
+Measure encoding and decoding of text and binary bodies.
+
+The :class:`~glinda.content._ContentHandler` methods are measured on
+their own and through :meth:`~glinda.content.HandlerMixin.get_request_body`
+and :meth:`~glinda.content.HandlerMixin.send_response` for a range of
+payload sizes.
+
+"""
+import json
+
+import msgpack
+from tornado import web
+
+from glinda import content
+
+from benchmarks import support
+
+
+PAYLOAD_SIZES = [('100B', 100), ('10KB', 10 * 1024), ('1MB', 1024 * 1024)]
+CODECS = [('json', 'application/json', json.dumps),
+          ('msgpack', 'application/msgpack', msgpack.packb)]
+
+
+class CodecHandler(content.HandlerMixin, web.RequestHandler):
+    pass
+
+
+def collect(options):
+    registry = support.make_registry()
+    application = web.Application(content_registry=registry)
+    for size_label, size in PAYLOAD_SIZES:
+        document = support.make_document(size)
+        for codec_label, content_type, dumps in CODECS:
+            handler, _ = registry._select_request_handler(content_type)
+            body = dumps(document)
+            if not isinstance(body, bytes):
+                body = body.encode('utf-8')
+            prefix = 'codec.{0}.{1}'.format(codec_label, size_label)
+
+            yield support.Benchmark(
+                prefix + '.pack_bytes',
+                lambda handler=handler, document=document:
+                    handler.pack_bytes(document))
+            yield support.Benchmark(
+                prefix + '.unpack_bytes',
+                lambda handler=handler, body=body:
+                    handler.unpack_bytes(body))
+
+            def get_request_body(body=body, content_type=content_type):
+                request_handler = support.make_handler(
+                    application, CodecHandler, method='POST', body=body,
+                    headers={'Content-Type': content_type})
+                request_handler.get_request_body()
+
+            def send_response(document=document, content_type=content_type):
+                request_handler = support.make_handler(
+                    application, CodecHandler,
+                    headers={'Accept': content_type})
+                request_handler.send_response(document)
+
+            yield support.Benchmark(prefix + '.get_request_body',
+                                    get_request_body)
+            yield support.Benchmark(prefix + '.send_response', send_response)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+Measure the overhead of debug logging in the content handling path.
+
+Each debug statement in :mod:`glinda.content` is guarded so that its
+arguments are not evaluated when debug logging is disabled.  This
+benchmark compares a guarded statement with an unguarded
+:meth:`logging.Logger.debug` call and measures
+:meth:`~glinda.content._ContentHandler.unpack_bytes` and
+:meth:`~glinda.content._ContentHandler.pack_bytes` on a small body with
+debug logging enabled and disabled.
+
+    $ python -m benchmarks.debug_logging
+
+"""
+import argparse
+import json
+import logging
+
+from glinda import content
+
+from benchmarks import support
+
+
+class _DebugLevel(object):
+    """Run a callable with the content logger at a specific level."""
+
+    def __init__(self, level, func):
+        self.level = level
+        self.func = func
+
+    def __call__(self):
+        original = content.LOGGER.level
+        content.LOGGER.setLevel(self.level)
+        try:
+            self.func()
+        finally:
+            content.LOGGER.setLevel(original)
+
+
+def _make_handler():
+    handler = content._ContentHandler('application/json')
+    handler.dict_to_string = json.dumps
+    handler.string_to_dict = json.loads
+    handler.default_encoding = 'utf-8'
+    return handler
+
+
+def collect(options):
+    handler = _make_handler()
+    body, document = b'{"status":"ok"}', {'status': 'ok'}
+    content.LOGGER.addHandler(logging.NullHandler())
+    content.LOGGER.propagate = False
+
+    def unguarded():
+        for _ in range(100):
+            content.LOGGER.debug('%r decoding %d bytes with encoding of %s',
+                                 handler, len(body), 'utf-8')
+
+    def guarded():
+        for _ in range(100):
+            if __debug__ and content._debug_enabled():
+                content.LOGGER.debug(
+                    '%r decoding %d bytes with encoding of %s',
+                    handler, len(body), 'utf-8')
+
+    def unpack():
+        for _ in range(100):
+            handler.unpack_bytes(body)
+
+    def pack():
+        for _ in range(100):
+            handler.pack_bytes(document)
+
+    for label, level in (('debug-off', logging.INFO),
+                         ('debug-on', logging.DEBUG)):
+        prefix = 'debug_logging.{0}'.format(label)
+        yield support.Benchmark(prefix + '.unguarded-statement',
+                                _DebugLevel(level, unguarded),
+                                operations=100)
+        yield support.Benchmark(prefix + '.guarded-statement',
+                                _DebugLevel(level, guarded),
+                                operations=100)
+        yield support.Benchmark(prefix + '.unpack_bytes',
+                                _DebugLevel(level, unpack), operations=100)
+        yield support.Benchmark(prefix + '.pack_bytes',
+                                _DebugLevel(level, pack), operations=100)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--filter', default='*')
+    parser.add_argument('--number', type=int, default=100,
+                        help='number of calls per measurement')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of measurements to take')
+    support.run_benchmarks([collect], parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Measure response content negotiation.
+
+Negotiation is measured with the negotiation cache both warm (the usual
+case) and cold (a previously unseen :mailheader:`Accept` header) across
+headers of increasing complexity and registries of increasing size.
+Cold negotiation is also measured against a frozen copy of each registry
+to show the effect of indexing the registered types, and requests
+without an :mailheader:`Accept` header are measured against a registry
+with a default content type.
+
+"""
+import functools
+
+from tornado import web
+
+from glinda import content
+
+from benchmarks import support
+
+
+ACCEPT_HEADERS = [
+    ('wildcard', '*/*'),
+    ('exact', 'application/json'),
+    ('browser', 'text/html,application/xhtml+xml,application/xml;q=0.9,'
+                'image/webp,*/*;q=0.8'),
+    ('complex', ', '.join(['application/vnd.other.v{0}+json;q=0.{1}'.format(
+        index, 9 - index % 9) for index in range(20)] +
+        ['application/msgpack;q=0.5', 'application/json;q=0.7'])),
+]
+
+TYPE_COUNTS = [2, 10, 50]
+
+
+class NegotiatingHandler(content.HandlerMixin, web.RequestHandler):
+    pass
+
+
+def collect(options):
+    body = {'status': 'ok'}
+    for type_count in TYPE_COUNTS:
+        registry = support.make_registry(type_count)
+        application = web.Application(content_registry=registry)
+        frozen_registry = support.make_registry(type_count)
+        frozen_registry.freeze()
+        frozen_application = web.Application(content_registry=frozen_registry)
+        for label, accept in ACCEPT_HEADERS:
+            handler = support.make_handler(application, NegotiatingHandler,
+                                           headers={'Accept': accept})
+            frozen_handler = support.make_handler(
+                frozen_application, NegotiatingHandler,
+                headers={'Accept': accept})
+
+            def warm(handler=handler):
+                handler.send_response(body)
+                handler.clear()
+
+            def cold(handler=handler, registry=registry):
+                registry._negotiation_cache.clear()
+                handler.send_response(body)
+                handler.clear()
+
+            prefix = 'negotiation.types-{0}.{1}'.format(type_count, label)
+            yield support.Benchmark(prefix + '.warm', warm)
+            yield support.Benchmark(prefix + '.cold', cold)
+            yield support.Benchmark(
+                prefix + '.frozen-cold',
+                functools.partial(cold, frozen_handler, frozen_registry))
+
+        default_registry = support.make_registry(type_count)
+        default_registry.default_content_type = 'application/json'
+        handler = support.make_handler(
+            web.Application(content_registry=default_registry),
+            NegotiatingHandler)
+
+        def default(handler=handler):
+            handler.send_response(body)
+            handler.clear()
+
+        yield support.Benchmark(
+            'negotiation.types-{0}.missing.default'.format(type_count),
+            default)
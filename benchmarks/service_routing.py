@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+"""
+Measure how the service layer finds the handler for a request.
+
+Service resources are kept in a hash table and a trie of template
+segments instead of Tornado's list of routing rules.  This benchmark
+routes a request for the most recently added resource through both
+with an increasing number of resources.
+
+    $ python -m benchmarks --filter 'service_routing.*'
+
+"""
+from tornado import httputil, web
+
+from glinda.testing import services
+
+from benchmarks import support
+
+
+def _make_request(path):
+    return httputil.HTTPServerRequest(
+        method='GET', uri=path, headers=httputil.HTTPHeaders(),
+        connection=support._NullConnection())
+
+
+def _make_rules_application(resources):
+    application = web.Application([web.url('/', services._ErrorHandler)])
+    for resource in resources:
+        application.default_router.rules.insert(-1, web.url(
+            resource, services._ServiceHandler,
+            kwargs={'service': None}))
+    return application
+
+
+def collect(options):
+    for count in (10, 100, 1000):
+        literals = ['/resource-{0}'.format(i) for i in range(count)]
+        templates = ['/resource-{0}/{{id}}'.format(i) for i in range(count)]
+
+        rules = _make_rules_application(literals)
+        application = services._Application()
+        for resource in literals + templates:
+            application.add_resource(None, resource)
+
+        for label, router, path in (
+                ('rules', rules, literals[-1]),
+                ('literal', application, literals[-1]),
+                ('template', application, literals[-1] + '/1')):
+            request = _make_request(path)
+            yield support.Benchmark(
+                'service_routing.resources-{0}.{1}'.format(count, label),
+                lambda router=router, request=request:
+                router.find_handler(request))
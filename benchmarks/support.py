@@ -0,0 +1,179 @@
+"""
+Shared machinery for the benchmark suite.
+
+Each benchmark module exposes a ``collect(options)`` function that
+yields :class:`Benchmark` instances.  :func:`run_benchmarks` times
+each one with :func:`timeit.repeat` and reports the best per-operation
+latency along with the equivalent operations per second.  Taking the
+best of several measurements keeps the numbers reasonably stable from
+run to run so that they can be compared across upgrades.
+
+"""
+import fnmatch
+import timeit
+
+from tornado import gen, httpclient, httpserver, httputil, ioloop, netutil, web
+
+
+class Benchmark(object):
+    """
+    A named operation to measure.
+
+    :param str name: dotted name of the benchmark
+    :param callable func: called without arguments to run the
+        measured code
+    :param int operations: number of operations that each call to
+        `func` performs.  This is used to report per-operation times
+        for functions that run a batch of operations per call.
+
+    """
+
+    def __init__(self, name, func, operations=1):
+        super(Benchmark, self).__init__()
+        self.name = name
+        self.func = func
+        self.operations = operations
+
+    def measure(self, number, repeat):
+        """
+        Run the benchmark.
+
+        :return: the best time per operation in seconds
+
+        """
+        self.func()  # warm caches and lazily created state
+        timings = timeit.repeat(self.func, number=number, repeat=repeat)
+        return min(timings) / (number * self.operations)
+
+
+def run_benchmarks(collectors, options):
+    """
+    Run and report on the benchmarks that match ``options.filter``.
+
+    :param collectors: iterable of ``collect(options)`` functions
+    :param options: parsed command line options with ``filter``,
+        ``number``, and ``repeat`` attributes
+    :return: :class:`dict` mapping benchmark names to the best time
+        per operation in seconds
+
+    """
+    results = {}
+    print('{0:<60s} {1:>12s} {2:>12s}'.format(
+        'benchmark', 'usec/op', 'ops/sec'))
+    for collect in collectors:
+        for benchmark in collect(options):
+            if not fnmatch.fnmatch(benchmark.name, options.filter):
+                continue
+            elapsed = benchmark.measure(options.number, options.repeat)
+            results[benchmark.name] = elapsed
+            print('{0:<60s} {1:12.2f} {2:12.0f}'.format(
+                benchmark.name, elapsed * 1e6, 1.0 / elapsed))
+    return results
+
+
+class _NullConnection(object):
+    """Just enough of an HTTP connection to create request handlers."""
+
+    def set_close_callback(self, callback):
+        pass
+
+
+def make_handler(application, handler_class, method='GET', headers=None,
+                 body=b''):
+    """
+    Create a request handler without a network connection.
+
+    :param tornado.web.Application application: application that the
+        handler belongs to
+    :param handler_class: :class:`~tornado.web.RequestHandler` subclass
+        to create
+    :param str method: HTTP method of the request
+    :param dict headers: request headers
+    :param bytes body: request body
+
+    This is used to measure the per-call cost of the content handling
+    methods without including the cost of the HTTP stack.  Output is
+    buffered by the handler and never flushed.
+
+    """
+    request = httputil.HTTPServerRequest(
+        method=method, uri='/', headers=httputil.HTTPHeaders(headers or {}),
+        body=body, connection=_NullConnection())
+    return handler_class(application, request)
+
+
+class InProcessServer(object):
+    """
+    Runs a Tornado application on an ephemeral port.
+
+    :param tornado.web.Application application: the application to run
+
+    The server and client share a private IOLoop so that requests per
+    second can be measured through the entire HTTP stack.
+
+    """
+
+    def __init__(self, application):
+        super(InProcessServer, self).__init__()
+        self.io_loop = ioloop.IOLoop()
+        self.io_loop.make_current()
+        sockets = netutil.bind_sockets(0, '127.0.0.1')
+        self.server = httpserver.HTTPServer(application)
+        self.server.add_sockets(sockets)
+        self.base_url = 'http://127.0.0.1:{0}'.format(
+            sockets[0].getsockname()[1])
+        self.client = httpclient.AsyncHTTPClient()
+
+    def fetch_many(self, count, path='/', concurrency=10, **kwargs):
+        """Make `count` requests with at most `concurrency` in flight."""
+
+        @gen.coroutine
+        def worker(share):
+            for _ in range(share):
+                response = yield self.client.fetch(self.base_url + path,
+                                                   **kwargs)
+                assert response.code == 200, response.code
+
+        @gen.coroutine
+        def run():
+            shares = [count // concurrency] * concurrency
+            for index in range(count % concurrency):
+                shares[index] += 1
+            yield [worker(share) for share in shares if share]
+
+        self.io_loop.run_sync(run)
+
+
+def make_registry(type_count=2):
+    """
+    Create a registry with JSON, msgpack, and filler content types.
+
+    :param int type_count: total number of content types to register.
+        Types beyond JSON and msgpack are vendor specific JSON types
+        that exist to make negotiation work harder.
+
+    """
+    import json
+    import msgpack
+    from glinda import content
+
+    registry = content.ContentRegistry()
+    registry.register_text_type('application/json', 'utf-8',
+                                json.dumps, json.loads)
+    registry.register_binary_type('application/msgpack', msgpack.packb,
+                                  msgpack.unpackb)
+    for index in range(type_count - 2):
+        registry.register_text_type(
+            'application/vnd.example.v{0}+json'.format(index), 'utf-8',
+            json.dumps, json.loads)
+    return registry
+
+
+def make_document(target_size):
+    """Create a JSON-compatible document of roughly `target_size` bytes."""
+    document, index = {'entries': []}, 0
+    entry_size = 64
+    while (index + 1) * entry_size <= max(target_size, entry_size):
+        document['entries'].append({'id': index, 'name': 'x' * 40})
+        index += 1
+    return document
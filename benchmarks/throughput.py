@@ -0,0 +1,55 @@
+"""
+Measure requests per second through an in-process Tornado application.
+
+Requests are made over the loopback interface with a fixed number in
+flight so that the entire HTTP stack is included in the measurement.
+
+"""
+import json
+
+import msgpack
+from tornado import web
+
+from glinda import content
+
+from benchmarks import support
+
+
+REQUESTS_PER_CALL = 100
+
+
+class EchoHandler(content.HandlerMixin, web.RequestHandler):
+
+    def get(self):
+        self.send_response(self.application.settings['document'])
+
+    def post(self):
+        self.send_response(self.get_request_body())
+
+
+def collect(options):
+    for size_label, size in [('100B', 100), ('10KB', 10 * 1024)]:
+        document = support.make_document(size)
+        application = web.Application(
+            [web.url('/', EchoHandler)], document=document,
+            content_registry=support.make_registry())
+        server = support.InProcessServer(application)
+        for codec_label, content_type, body in [
+                ('json', 'application/json',
+                 json.dumps(document).encode('utf-8')),
+                ('msgpack', 'application/msgpack', msgpack.packb(document))]:
+            prefix = 'throughput.{0}.{1}'.format(codec_label, size_label)
+            yield support.Benchmark(
+                prefix + '.get',
+                lambda server=server, content_type=content_type:
+                    server.fetch_many(REQUESTS_PER_CALL,
+                                      headers={'Accept': content_type}),
+                operations=REQUESTS_PER_CALL)
+            yield support.Benchmark(
+                prefix + '.post',
+                lambda server=server, content_type=content_type, body=body:
+                    server.fetch_many(REQUESTS_PER_CALL, method='POST',
+                                      body=body,
+                                      headers={'Accept': content_type,
+                                               'Content-Type': content_type}),
+                operations=REQUESTS_PER_CALL)
@@ -1,12 +1,202 @@
+import codecs
+import collections
+import functools
+import hashlib
+import itertools
 import logging
+import operator
+import timeit
+import zlib
 
-from ietfparse import algorithms, datastructures, errors, headers
-from tornado import web, escape
+from ietfparse import algorithms, errors, headers
+from tornado import escape, gen, web
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
 
 
 LOGGER = logging.getLogger(__name__)
 
 
+def _debug_enabled():
+    """
+    Is debug logging enabled for this module?
+
+    Debug logging in the content handling path is written as::
+
+        if __debug__ and _debug_enabled():
+            LOGGER.debug(...)
+
+    so that the cost of formatting arguments is avoided when debug
+    logging is disabled.  The logging module caches the result of
+    :meth:`~logging.Logger.isEnabledFor` (on Python 3.7 and newer)
+    until the logging configuration changes.  Running Python with
+    :option:`-O` removes the statements entirely since the compiler
+    discards ``if __debug__`` blocks.
+
+    Records in the request path include fields such as ``content_type``,
+    ``num_bytes``, and ``encoding`` as attributes (via ``extra``) so
+    that structured log formatters can emit them.
+
+    """
+    return LOGGER.isEnabledFor(logging.DEBUG)
+
+
+CacheInfo = collections.namedtuple('CacheInfo',
+                                   ['hits', 'misses', 'maxsize', 'currsize'])
+"""Cache statistics as returned by :func:`negotiation_cache_info`."""
+
+_MISSING = object()
+_MAX_RENDERED_HEADERS = 16
+
+_CachedResponse = collections.namedtuple('_CachedResponse',
+                                         ['encoding', 'body', 'etag'])
+
+
+def _gzip_compress(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _deflate_compress(data, level):
+    return zlib.compress(data, level)
+
+
+_content_codings = {'gzip': _gzip_compress, 'deflate': _deflate_compress}
+if brotli is not None:  # pragma: no cover
+    _content_codings['br'] = lambda data, level: brotli.compress(data)
+if zstandard is not None:  # pragma: no cover
+    _content_codings['zstd'] = (
+        lambda data, level: zstandard.ZstdCompressor().compress(data))
+
+
+def _parse_quality_list(header_value):
+    """
+    Parse a list of tokens with optional quality values.
+
+    :param str header_value: header value to parse
+    :return: :class:`list` of (token, quality) tuples sorted from
+        highest to lowest quality.  Tokens with the same quality
+        retain their order from the header.
+
+    Unlike :func:`ietfparse.headers.parse_accept_charset`, the
+    quality values are retained so that explicitly rejected tokens
+    can be distinguished from acceptable ones.
+
+    """
+    values = []
+    for item in header_value.split(','):
+        token, _, parameters = item.partition(';')
+        token = token.strip().lower()
+        if not token:
+            continue
+        quality = 1.0
+        for parameter in parameters.split(';'):
+            name, _, value = parameter.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        values.append((token, quality))
+    values.sort(key=lambda value: -value[1])
+    return values
+
+
+def _select_content_coding(accept_encoding, available):
+    """
+    Select a content coding for a response.
+
+    :param str accept_encoding: the :mailheader:`Accept-Encoding`
+        header value
+    :param available: names of the codings that can be applied in
+        order of server preference
+    :return: the selected coding or :data:`None` if the response
+        should not be compressed
+
+    The coding with the highest quality value wins with ties broken by
+    the order of `available`.  The identity coding is only preferred
+    if it is explicitly listed with a higher quality.
+
+    """
+    qualities, wildcard = {}, 0.0
+    for token, quality in _parse_quality_list(accept_encoding):
+        if token == '*':
+            wildcard = quality
+        else:
+            qualities.setdefault(token, quality)
+
+    selected, selected_quality = None, 0.0
+    for coding in available:
+        quality = qualities.get(coding, wildcard)
+        if quality > selected_quality:
+            selected, selected_quality = coding, quality
+    if qualities.get('identity', 0.0) > selected_quality:
+        return None
+    return selected
+
+
+def _select_charsets(accept_charset):
+    """
+    Select the character sets to encode a response with.
+
+    :param str accept_charset: the :mailheader:`Accept-Charset`
+        header value
+    :return: a :class:`tuple` of the acceptable character sets from
+        the most to the least preferred and a :class:`frozenset` of
+        the refused character sets.  :data:`None` represents the
+        default encoding of the content type and is used for ``*``.
+
+    Character sets with a quality of zero are refused.  They are
+    normalized to their codec names so that aliases are refused as
+    well, and a refused ``*`` is kept as-is.  If nothing is
+    acceptable, then the default encoding is used unless it is
+    refused -- see :func:`_is_charset_refused`.
+
+    """
+    charsets, refused = [], set()
+    for token, quality in _parse_quality_list(accept_charset):
+        if quality > 0.0:
+            charsets.append(None if token == '*' else token)
+        elif token == '*':
+            refused.add(token)
+        else:
+            try:
+                refused.add(codecs.lookup(token).name)
+            except LookupError:
+                pass
+    return tuple(charsets) or (None,), frozenset(refused)
+
+
+def _is_charset_refused(charset, refused, fallback=False):
+    """
+    Has `charset` been refused by the client?
+
+    :param str charset: the character set to check
+    :param refused: the refused character sets returned from
+        :func:`_select_charsets`
+    :param bool fallback: is `charset` being used because nothing
+        acceptable was named explicitly?  A refused ``*`` refuses
+        every character set that is not named explicitly.
+
+    """
+    if not refused:
+        return False
+    if fallback and '*' in refused:
+        return True
+    try:
+        return codecs.lookup(charset).name in refused
+    except LookupError:
+        return False
+
+
 class _ContentHandler(object):
     """
     Translate between dictionaries and bytes.
@@ -28,35 +218,348 @@ class _ContentHandler(object):
         self.string_to_dict = None
         self.dict_to_bytes = None
         self.bytes_to_dict = None
+        self.incremental_string_loader = None
+        self.incremental_bytes_loader = None
+        self.iterable_to_strings = None
+        self.iterable_to_bytes = None
+        self.record_string_loader = None
+        self.record_bytes_loader = None
+        self.typed_string_loader = None
+        self.typed_bytes_loader = None
+        self.accepts_buffer = False
+        self.native_strings = False
+        self.executor = None
+        self.offload_threshold = 0
+        self.max_body_size = None
+        self.max_depth = None
+        self.max_elements = None
         self.default_encoding = None
+        self._content_type_headers = {}
+
+    def __getstate__(self):
+        # executors and cached values stay behind when the handler
+        # is sent to a process pool
+        state = self.__dict__.copy()
+        state['executor'] = None
+        state['_content_type_headers'] = {}
+        return state
+
+    def should_offload(self, num_bytes=None):
+        """
+        Should encoding or decoding be run on the executor?
+
+        :param int num_bytes: size of the payload if it is known
+        :rtype: bool
+
+        Work is offloaded if an executor is registered for the content
+        type and the payload is at least :attr:`offload_threshold`
+        bytes.  Payloads of unknown size are always offloaded.
+
+        """
+        if self.executor is None:
+            return False
+        return num_bytes is None or num_bytes >= self.offload_threshold
+
+    def check_body_size(self, num_bytes):
+        """
+        Is a request body of `num_bytes` too large?
+
+        :return: the name of the exceeded limit or :data:`None`
+
+        """
+        if self.max_body_size is not None and num_bytes > self.max_body_size:
+            return 'max_body_size'
+        return None
+
+    def check_structure(self, obj):
+        """
+        Is a decoded request body too deeply nested or too large?
 
-    def unpack_bytes(self, obj_bytes, encoding=None):
-        """Unpack a byte stream into a dictionary."""
+        :param obj: the decoded body
+        :return: the name of the exceeded limit or :data:`None`
+
+        Every value inside of a dictionary or list counts as an element.
+        The body itself is at a depth of one.  The body is only walked
+        when :attr:`max_depth` or :attr:`max_elements` is set.
+
+        """
+        if self.max_depth is None and self.max_elements is None:
+            return None
+        if not isinstance(obj, (dict, list)):
+            return None
+        max_depth = (float('inf') if self.max_depth is None
+                     else self.max_depth)
+        max_elements = (float('inf') if self.max_elements is None
+                        else self.max_elements)
+        elements, pending = 0, [(obj, 1)]
+        while pending:
+            value, depth = pending.pop()
+            if depth > max_depth:
+                return 'max_depth'
+            children = value.values() if isinstance(value, dict) else value
+            for child in children:
+                elements += 1
+                if isinstance(child, (dict, list)):
+                    pending.append((child, depth + 1))
+            if elements > max_elements:
+                return 'max_elements'
+        return None
+
+    def unpack_bytes(self, obj_bytes, encoding=None, body_type=None):
+        """
+        Unpack a byte stream into a dictionary.
+
+        :param bytes obj_bytes: the packed body
+        :param str encoding: optional character set of text bodies
+        :param type body_type: optional type to unpack the body into.
+            This is ignored unless a typed loader is registered.
+
+        If `body_type` is specified and a typed loader is registered,
+        then it decodes and validates the body in one step.  Otherwise,
+        the body is unpacked into a dictionary.
+
+        """
         assert self.bytes_to_dict or self.string_to_dict
         encoding = encoding or self.default_encoding
-        LOGGER.debug('%r decoding %d bytes with encoding of %s',
-                     self, len(obj_bytes), encoding)
+        if __debug__ and _debug_enabled():
+            LOGGER.debug('%r decoding %d bytes with encoding of %s',
+                         self, len(obj_bytes), encoding,
+                         extra={'content_type': self.content_type,
+                                'num_bytes': len(obj_bytes),
+                                'encoding': encoding})
+        if body_type is not None and self.typed_bytes_loader:
+            if self.accepts_buffer:
+                obj_bytes = memoryview(obj_bytes)
+            return self.typed_bytes_loader(obj_bytes, body_type)
+        if body_type is not None and self.typed_string_loader:
+            return self.typed_string_loader(obj_bytes.decode(encoding),
+                                            body_type)
         if self.bytes_to_dict:
-            return escape.recursive_unicode(self.bytes_to_dict(obj_bytes))
+            if self.accepts_buffer:
+                obj_bytes = memoryview(obj_bytes)
+            return self.normalize_strings(self.bytes_to_dict(obj_bytes))
         return self.string_to_dict(obj_bytes.decode(encoding))
 
-    def pack_bytes(self, obj_dict, encoding=None):
-        """Pack a dictionary into a byte stream."""
+    @property
+    def has_typed_loader(self):
+        """Is a typed loader registered for the content type?"""
+        return bool(self.typed_bytes_loader or self.typed_string_loader)
+
+    @property
+    def checks_structure(self):
+        """Is :attr:`max_depth` or :attr:`max_elements` set?"""
+        return self.max_depth is not None or self.max_elements is not None
+
+    @staticmethod
+    def build_typed(obj_dict, body_type):
+        """
+        Create an instance of `body_type` from a decoded body.
+
+        :param dict obj_dict: the decoded body
+        :param type body_type: the type to create.  It is called with
+            the members of `obj_dict` as keyword parameters.
+        :raises: :exc:`ValueError` if the body is not a dictionary or
+            does not match the parameters of `body_type`
+
+        """
+        if not isinstance(obj_dict, dict):
+            raise ValueError('cannot create {0} from {1}'.format(
+                body_type.__name__, type(obj_dict).__name__))
+        try:
+            return body_type(**obj_dict)
+        except TypeError as error:
+            raise ValueError('cannot create {0} - {1}'.format(
+                body_type.__name__, error))
+
+    def normalize_strings(self, obj_dict):
+        """
+        Convert byte strings in a binary loader's result into text.
+
+        Unless the loader was registered as producing native strings,
+        the result is walked by :func:`tornado.escape.recursive_unicode`.
+
+        """
+        if self.native_strings:
+            return obj_dict
+        return escape.recursive_unicode(obj_dict)
+
+    def start_unpacking(self, encoding=None):
+        """
+        Start unpacking a byte stream that arrives in chunks.
+
+        :param str encoding: optional character set of the stream
+        :return: an object with ``feed(chunk)`` and ``close()`` methods.
+            ``close`` returns the unpacked dictionary.
+
+        If an incremental loader is registered for the content type,
+        then each chunk is passed to it as it arrives.  Otherwise, the
+        chunks are collected and passed to :meth:`unpack_bytes` when
+        the stream is closed.
+
+        """
+        assert self.bytes_to_dict or self.string_to_dict
+        encoding = encoding or self.default_encoding
+        if __debug__ and _debug_enabled():
+            LOGGER.debug('%r starting to decode stream with encoding of %s',
+                         self, encoding)
+        return _IncrementalUnpacker(self, encoding)
+
+    def start_unpacking_records(self, encoding=None):
+        """
+        Start unpacking a stream of records that arrives in chunks.
+
+        :param str encoding: optional character set of the stream
+        :return: an object with ``feed(chunk)`` and ``close()`` methods
+            that return the records that were completed
+
+        This requires that a record loader was registered for the
+        content type.
+
+        """
+        assert self.record_bytes_loader or self.record_string_loader
+        encoding = encoding or self.default_encoding
+        if __debug__ and _debug_enabled():
+            LOGGER.debug('%r starting to decode records with encoding of %s',
+                         self, encoding)
+        return _RecordUnpacker(self, encoding)
+
+    def pack_bytes(self, obj_dict, encoding=None, alternatives=(),
+                   refused=frozenset()):
+        """
+        Pack a dictionary into a byte stream.
+
+        :param dict obj_dict: the object to pack
+        :param str encoding: optional character set to encode text with
+        :param alternatives: character sets to try in order if the
+            text cannot be represented in `encoding`.  :data:`None`
+            represents the default encoding.
+        :param refused: character sets that the client refused as
+            returned from :func:`_select_charsets`
+        :return: a :class:`tuple` of the character set used (or
+            :data:`None` for binary content) and the packed bytes
+        :raises: :class:`tornado.web.HTTPError` if none of the
+            character sets exist or are allowed (406)
+
+        Text is serialized once and then encoded with each character
+        set until one succeeds.  Character sets that do not exist and
+        default encodings that are refused are skipped.  If the text
+        cannot be represented in any of them, then it is encoded as
+        UTF-8 unless UTF-8 is refused.
+
+        """
         assert self.dict_to_bytes or self.dict_to_string
+        candidates = [encoding]
+        candidates.extend(alternatives)
         encoding = encoding or self.default_encoding or 'utf-8'
-        LOGGER.debug('%r encoding dict with encoding %s', self, encoding)
+        if __debug__ and _debug_enabled():
+            LOGGER.debug('%r encoding dict with encoding %s', self, encoding,
+                         extra={'content_type': self.content_type,
+                                'encoding': encoding})
         if self.dict_to_bytes:
             return None, self.dict_to_bytes(obj_dict)
-        try:
-            return encoding, self.dict_to_string(obj_dict).encode(encoding)
-        except LookupError as error:
+
+        text, error = self.dict_to_string(obj_dict), None
+        for candidate in candidates:
+            fallback = candidate is None
+            candidate = candidate or self.default_encoding or 'utf-8'
+            if _is_charset_refused(candidate, refused, fallback):
+                continue
+            try:
+                return candidate, text.encode(candidate)
+            except LookupError as lookup_error:
+                error = error or lookup_error
+            except UnicodeEncodeError as encode_error:
+                error = encode_error
+        if (not isinstance(error, UnicodeEncodeError) or
+                _is_charset_refused('utf-8', refused, fallback=True)):
             raise web.HTTPError(
                 406, 'failed to encode result %r', error,
-                reason='target charset {0} not found'.format(encoding))
-        except UnicodeEncodeError as error:
-            LOGGER.warning('failed to encode text as %s - %s, trying utf-8',
-                           encoding, str(error))
-            return 'utf-8', self.dict_to_string(obj_dict).encode('utf-8')
+                reason='target charset {0} not acceptable'.format(encoding))
+        LOGGER.warning('failed to encode text as %s - %s, using utf-8',
+                       encoding, str(error))
+        return 'utf-8', text.encode('utf-8')
+
+    def pack_stream(self, iterable, encoding=None, alternatives=(),
+                    refused=frozenset()):
+        """
+        Pack an iterable into a sequence of byte chunks.
+
+        :param iterable: the objects to pack
+        :param str encoding: optional character set to encode text with
+        :param alternatives: character sets to try in order if the
+            text cannot be represented in `encoding`.  :data:`None`
+            represents the default encoding.
+        :param refused: character sets that the client refused as
+            returned from :func:`_select_charsets`
+        :return: a :class:`tuple` of the character set used (or
+            :data:`None` for binary content) and an iterable of
+            :class:`bytes` chunks
+        :raises: :class:`tornado.web.HTTPError` if none of the
+            character sets exist or are allowed (406)
+
+        If a streaming dumper is registered, then the chunks are
+        produced lazily as `iterable` is consumed.  Otherwise, the
+        iterable is materialized as a :class:`list` and packed with
+        :meth:`pack_bytes`.  Since the response headers may have been
+        sent by the time a chunk fails to encode, text is only streamed
+        with a Unicode transformation format which can represent every
+        character.  The most preferred UTF character set is used even
+        if a non-UTF character set is preferred over it.  When none of
+        the character sets is a UTF, the iterable is materialized and
+        packed with :meth:`pack_bytes` so that each character set can
+        be tried in turn.
+
+        """
+        assert self.dict_to_bytes or self.dict_to_string
+        if self.dict_to_bytes and self.iterable_to_bytes:
+            if __debug__ and _debug_enabled():
+                LOGGER.debug('%r encoding binary stream', self)
+            return None, self.iterable_to_bytes(iterable)
+        if not self.dict_to_bytes and self.iterable_to_strings:
+            for candidate in itertools.chain([encoding], alternatives):
+                fallback = candidate is None
+                candidate = candidate or self.default_encoding or 'utf-8'
+                if _is_charset_refused(candidate, refused, fallback):
+                    continue
+                try:
+                    codec = codecs.lookup(candidate)
+                except LookupError:
+                    continue
+                if codec.name.startswith('utf'):
+                    if __debug__ and _debug_enabled():
+                        LOGGER.debug('%r encoding stream with encoding %s',
+                                     self, candidate)
+                    return candidate, _encode_chunks(
+                        codec.incrementalencoder(),
+                        self.iterable_to_strings(iterable))
+        encoding, obj_bytes = self.pack_bytes(list(iterable), encoding,
+                                              alternatives, refused)
+        return encoding, [obj_bytes]
+
+    def get_content_type_header(self, encoding=None):
+        """
+        Retrieve the :mailheader:`Content-Type` value for a response.
+
+        :param str encoding: optional character set to include
+        :return: the rendered header value
+
+        Header values are rendered once per character set and then
+        reused so that sending a response does not allocate and
+        format a new :class:`~ietfparse.datastructures.ContentType`.
+        The number of rendered values is bounded since the character
+        set name is ultimately controlled by the client.
+
+        """
+        try:
+            return self._content_type_headers[encoding]
+        except KeyError:
+            content_type = headers.parse_content_type(self.content_type)
+            if encoding:
+                content_type.parameters['charset'] = encoding
+            header_value = str(content_type)
+            if len(self._content_type_headers) < _MAX_RENDERED_HEADERS:
+                self._content_type_headers[encoding] = header_value
+            return header_value
 
     def __repr__(self):
         return '<{}.{} for {} unpacks {}, packs {}>'.format(
@@ -67,79 +570,983 @@ class _ContentHandler(object):
         )
 
 
-_content_handlers = {}
-_content_types = {}
+class _LRUCache(object):
+    """
+    Bounded mapping that discards the least recently used entry.
+
+    :param int maxsize: maximum number of entries to retain
+
+    This is a minimal stand-in for :func:`functools.lru_cache` that
+    works with explicit keys and can be cleared when the content
+    registry changes.  It keeps track of cache hits and misses so
+    that the effectiveness can be reported by :meth:`.info`.
 
+    """
+
+    def __init__(self, maxsize):
+        super(_LRUCache, self).__init__()
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+
+    def get(self, key, default=None):
+        """Retrieve `key` and mark it as most recently used."""
+        try:
+            value = self._entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self._entries[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Store `value` for `key`, evicting old entries as necessary."""
+        self._entries.pop(key, None)
+        self._entries[key] = value
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """Discard all entries and reset the statistics."""
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        """Return a :data:`CacheInfo` describing the cache."""
+        return CacheInfo(self.hits, self.misses, self.maxsize,
+                         len(self._entries))
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _encode_chunks(encoder, chunks):
+    """
+    Encode `chunks` with an incremental encoder.
+
+    The encoder is finalized once `chunks` is exhausted so that
+    stateful encodings (e.g., ``iso2022_jp``) emit their closing
+    shift sequence.
+
+    """
+    for chunk in chunks:
+        yield encoder.encode(chunk)
+    final = encoder.encode(u'', final=True)
+    if final:
+        yield final
+
+
+def _decode_failure(error):
+    """Create the error for a request body that failed to decode."""
+    return web.HTTPError(400, 'failed to decode content body - %r', error,
+                         reason='Content body decode failure')
+
+
+def _typed_limits_error(content_type):
+    """Create the error for structure limits on a typed loader."""
+    return ValueError('max_depth and max_elements cannot be checked by the '
+                      'typed loader of {0}'.format(content_type))
+
+
+def _unpack_bytes(handler, obj_bytes, encoding, body_type=None):
+    """Run :meth:`_ContentHandler.unpack_bytes` in an executor."""
+    return handler.unpack_bytes(obj_bytes, encoding=encoding,
+                                body_type=body_type)
+
+
+def _pack_bytes(handler, obj_dict, encoding, alternatives=(),
+                refused=frozenset()):
+    """Run :meth:`_ContentHandler.pack_bytes` in an executor."""
+    return handler.pack_bytes(obj_dict, encoding=encoding,
+                              alternatives=alternatives, refused=refused)
+
+
+def _get_quality(content_type):
+    """Retrieve the quality of a parsed media range."""
+    return 1.0 if content_type.quality is None else content_type.quality
+
+
+class _CompiledNegotiator(object):
+    """
+    Negotiates :mailheader:`Accept` headers against a fixed set of types.
+
+    :param content_types: mapping of media type strings to the
+        :class:`~ietfparse.datastructures.ContentType` instances that
+        are available
+
+    The selection is exactly the one that
+    :func:`ietfparse.algorithms.select_content_type` makes.  The
+    available types are sorted and indexed by top-level type once when
+    the negotiator is created instead of being sorted again for every
+    media range in the header, and each media range is only compared
+    with the types that it can match.
+
+    """
+
+    WILDCARD, PARTIAL, FULL_TYPE = 2, 1, 0
+
+    def __init__(self, content_types):
+        super(_CompiledNegotiator, self).__init__()
+        self._candidates = sorted(content_types.values())
+        self._by_type = collections.defaultdict(list)
+        for candidate in self._candidates:
+            self._by_type[candidate.content_type].append(candidate)
+
+    def select(self, accept_header):
+        """
+        Select the best available type for `accept_header`.
+
+        :param str accept_header: the raw header value
+        :return: the selected
+            :class:`~ietfparse.datastructures.ContentType` or
+            :data:`None` if nothing is acceptable
+
+        """
+        requested = headers.parse_http_accept_header(accept_header)
+        matches = []
+        for pattern in sorted(requested, key=_get_quality, reverse=True):
+            if pattern.content_type == '*':
+                candidates = self._candidates
+            else:
+                candidates = self._by_type.get(pattern.content_type, ())
+            for candidate in candidates:
+                if pattern.content_subtype not in (
+                        '*', candidate.content_subtype):
+                    continue
+                if candidate == pattern:
+                    if _get_quality(pattern) == 0.0:
+                        return None
+                    return candidate
+                matches.append((self._get_match_type(pattern),
+                                self._get_parameter_distance(candidate,
+                                                             pattern),
+                                candidate))
+        if not matches:
+            return None
+        return min(matches, key=operator.itemgetter(0, 1))[2]
+
+    def _get_match_type(self, pattern):
+        if pattern.content_type == pattern.content_subtype == '*':
+            return self.WILDCARD
+        if pattern.content_subtype == '*':
+            return self.PARTIAL
+        return self.FULL_TYPE
+
+    @staticmethod
+    def _get_parameter_distance(candidate, pattern):
+        distance = len(candidate.parameters)
+        for name, value in candidate.parameters.items():
+            if name in pattern.parameters:
+                if pattern.parameters[name] == value:
+                    distance -= 1
+                else:
+                    distance += 1
+        return distance
+
+
+class _IncrementalUnpacker(object):
+    """
+    Unpack a byte stream into a dictionary one chunk at a time.
+
+    :param _ContentHandler handler: the content handler to use
+    :param str encoding: character set of the stream
+
+    Instances are created by :meth:`_ContentHandler.start_unpacking`.
+    Binary incremental loaders receive the chunks as-is.  Text
+    incremental loaders receive strings that are decoded using an
+    incremental codec so that multi-byte characters that are split
+    across chunks are handled correctly.  If neither is registered,
+    the chunks are buffered and unpacked when the stream is closed.
+
+    """
+
+    def __init__(self, handler, encoding):
+        super(_IncrementalUnpacker, self).__init__()
+        self.handler = handler
+        self.encoding = encoding
+        self._chunks = []
+        self._loader = None
+        self._text_decoder = None
+        if handler.incremental_bytes_loader:
+            self._loader = handler.incremental_bytes_loader()
+        elif handler.incremental_string_loader:
+            self._loader = handler.incremental_string_loader()
+            self._text_decoder = codecs.getincrementaldecoder(encoding)()
+
+    def feed(self, chunk):
+        """Process the next chunk of bytes."""
+        if self._loader is None:
+            self._chunks.append(chunk)
+        elif self._text_decoder is not None:
+            self._loader.feed(self._text_decoder.decode(chunk))
+        else:
+            self._loader.feed(chunk)
+
+    def close(self, body_type=None):
+        """
+        Finish processing and return the unpacked dictionary.
+
+        :param type body_type: optional type to pass to
+            :meth:`_ContentHandler.unpack_bytes` when the chunks were
+            buffered
+
+        """
+        if self._loader is None:
+            return self.handler.unpack_bytes(b''.join(self._chunks),
+                                             encoding=self.encoding,
+                                             body_type=body_type)
+        if self._text_decoder is not None:
+            self._loader.feed(self._text_decoder.decode(b'', final=True))
+            return self._loader.close()
+        return self.handler.normalize_strings(self._loader.close())
+
+
+class _RecordUnpacker(object):
+    """
+    Unpack a byte stream into a sequence of records.
+
+    :param _ContentHandler handler: the content handler to use
+    :param str encoding: character set of the stream
+
+    Instances are created by :meth:`_ContentHandler.start_unpacking_records`.
+    Like :class:`_IncrementalUnpacker`, text record loaders are fed
+    strings that are decoded with an incremental codec.  Records produced
+    by binary record loaders are passed through
+    :meth:`_ContentHandler.normalize_strings`.
+
+    """
+
+    def __init__(self, handler, encoding):
+        super(_RecordUnpacker, self).__init__()
+        self.handler = handler
+        self.encoding = encoding
+        self._text_decoder = None
+        if handler.record_bytes_loader:
+            self._loader = handler.record_bytes_loader()
+        else:
+            self._loader = handler.record_string_loader()
+            self._text_decoder = codecs.getincrementaldecoder(encoding)()
+
+    def feed(self, chunk):
+        """Process the next chunk of bytes and return new records."""
+        if self._text_decoder is not None:
+            return self._loader.feed(self._text_decoder.decode(chunk))
+        return [self.handler.normalize_strings(record)
+                for record in self._loader.feed(chunk)]
+
+    def close(self):
+        """Finish processing and return the remaining records."""
+        if self._text_decoder is not None:
+            records = list(self._loader.feed(
+                self._text_decoder.decode(b'', final=True)))
+            records.extend(self._loader.close())
+            return records
+        return [self.handler.normalize_strings(record)
+                for record in self._loader.close()]
 
-def register_text_type(content_type, default_encoding, dumper, loader):
+
+class _LineRecordLoader(object):
+    """Record loader that decodes each line of text separately."""
+
+    def __init__(self, loader):
+        super(_LineRecordLoader, self).__init__()
+        self.loader = loader
+        self._partial = ''
+
+    def feed(self, text):
+        lines = (self._partial + text).split('\n')
+        self._partial = lines.pop()
+        return [self.loader(line) for line in lines if line.strip()]
+
+    def close(self):
+        line, self._partial = self._partial, ''
+        return [self.loader(line)] if line.strip() else []
+
+
+def line_records(loader):
+    """
+    Create a record loader for newline-delimited text.
+
+    :param loader: called to decode each non-blank line.
+        Calling convention: ``loader(str) -> dict``
+    :return: a factory that is suitable for the ``record_loader``
+        parameter of :meth:`ContentRegistry.register_text_type`
+
+    This is all that is needed to accept newline delimited JSON::
+
+        content.register_text_type(
+            'application/x-ndjson', 'utf-8', json.dumps, json.loads,
+            record_loader=content.line_records(json.loads))
+
+    """
+    return functools.partial(_LineRecordLoader, loader)
+
+
+class ResponseCache(object):
+    """
+    Retains encoded responses so that they are not encoded again.
+
+    :param int maxbytes: maximum number of encoded bytes to retain
+
+    Assign an instance to :attr:`HandlerMixin.response_cache` and pass
+    a ``cache_key`` to :meth:`HandlerMixin.send_response` to enable
+    caching.  Responses are stored per cache key, content type, and
+    acceptable character sets along with a strong entity tag that is
+    computed from the encoded bytes.  The least recently used responses
+    are discarded when the total size exceeds `maxbytes`.  Responses
+    that are larger than `maxbytes` are never stored.
+
+    The cache is not thread-safe.  It is meant to be shared by the
+    handlers that run on a single IOLoop.
+
+    """
+
+    def __init__(self, maxbytes=16 * 1024 * 1024):
+        super(ResponseCache, self).__init__()
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        self._currbytes = 0
+        self._entries = collections.OrderedDict()
+        self._variants = collections.defaultdict(set)
+
+    def get(self, key):
+        """
+        Retrieve a cached response.
+
+        :param key: a :class:`tuple` of the cache key, content type,
+            and acceptable character sets
+        :return: the cached response or :data:`None`
+
+        """
+        try:
+            entry = self._entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self._entries[key] = entry
+        self.hits += 1
+        return entry
+
+    def put(self, key, encoding, body):
+        """
+        Store an encoded response.
+
+        :param key: a :class:`tuple` of the cache key, content type,
+            and acceptable character sets
+        :param str encoding: character set that `body` is encoded with
+        :param bytes body: the encoded response
+        :return: the cached response which includes the entity tag
+
+        """
+        self._discard(key)
+        entry = _CachedResponse(
+            encoding, body, '"{0}"'.format(hashlib.sha1(body).hexdigest()))
+        if len(body) <= self.maxbytes:
+            self._entries[key] = entry
+            self._variants[key[0]].add(key)
+            self._currbytes += len(body)
+            while self._currbytes > self.maxbytes:
+                self._discard(next(iter(self._entries)))
+        return entry
+
+    def invalidate(self, cache_key):
+        """Discard every representation that is stored for `cache_key`."""
+        for key in list(self._variants.get(cache_key, ())):
+            self._discard(key)
+
+    def clear(self):
+        """Discard all entries and reset the statistics."""
+        self._entries.clear()
+        self._variants.clear()
+        self._currbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        """
+        Report on the effectiveness of the cache.
+
+        :return: a :data:`CacheInfo` instance.  The ``maxsize`` and
+            ``currsize`` fields are measured in bytes.
+
+        """
+        return CacheInfo(self.hits, self.misses, self.maxbytes,
+                         self._currbytes)
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._currbytes -= len(entry.body)
+            variants = self._variants[key[0]]
+            variants.discard(key)
+            if not variants:
+                del self._variants[key[0]]
+
+
+class ContentMetrics(object):
     """
-    Register handling for a text-based content type.
+    Receives measurements from the content handling code.
 
-    :param str content_type: content type to register the hooks for
-    :param str default_encoding: encoding to use if none is present
-        in the request
-    :param dumper: called to decode a string into a dictionary.
-        Calling convention: ``dumper(obj_dict).encode(encoding) -> bytes``
-    :param loader: called to encode a dictionary to a string.
-        Calling convention: ``loader(obj_bytes.decode(encoding)) -> dict``
+    Assign an instance to :attr:`ContentRegistry.metrics` to be called
+    for each negotiation, decode, and encode performed by the handlers
+    that use the registry.  The methods of this class do nothing so
+    override the ones that you are interested in and forward the values
+    to your metrics system (e.g., statsd timers or Prometheus histograms).
+    Times are in seconds as measured by :func:`timeit.default_timer`.
 
-    The decoding of a text content body takes into account decoding
-    the binary request body into a string before calling the underlying
-    dump/load routines.
+    The timers are not read at all when a registry does not have a
+    metrics instance.
 
     """
-    content_type = headers.parse_content_type(content_type)
-    content_type.parameters.clear()
-    key = str(content_type)
-    _content_types[key] = content_type
 
-    handler = _content_handlers.setdefault(key, _ContentHandler(key))
-    handler.dict_to_string = dumper
-    handler.string_to_dict = loader
-    handler.default_encoding = default_encoding or handler.default_encoding
+    def negotiated(self, content_type, elapsed):
+        """
+        Called when the response content type is selected.
+
+        :param str content_type: the selected content type
+        :param float elapsed: seconds spent negotiating the content
+            type and character set
+
+        """
+
+    def decoded(self, content_type, num_bytes, elapsed):
+        """
+        Called when a request body is decoded.
+
+        :param str content_type: the request content type
+        :param int num_bytes: size of the request body
+        :param float elapsed: seconds spent decoding
+
+        """
+
+    def encoded(self, content_type, num_bytes, elapsed):
+        """
+        Called when a response body is encoded.
+
+        :param str content_type: the response content type
+        :param int num_bytes: size of the encoded response before any
+            content coding is applied
+        :param float elapsed: seconds spent encoding
+
+        """
+
+    def limit_exceeded(self, content_type, limit):
+        """
+        Called when a request body is rejected by a limit.
+
+        :param str content_type: the request content type
+        :param str limit: the name of the limit that was exceeded --
+            ``max_body_size``, ``max_depth``, or ``max_elements``
+
+        """
 
 
-def register_binary_type(content_type, dumper, loader):
+class ContentRegistry(object):
     """
-    Register handling for a binary content type.
+    Maps content types to the hooks that encode and decode them.
+
+    :param int negotiation_cache_size: maximum number of
+        :mailheader:`Accept` header values to memoize
+    :param ContentMetrics metrics: optional instance to report
+        measurements to.  This is also available as the
+        :attr:`metrics` attribute.
+    :param str default_content_type: optional content type to respond
+        with when a request does not include an :mailheader:`Accept`
+        header.  See :attr:`default_content_type`.
+
+    A registry is the set of content types that a :class:`HandlerMixin`
+    negotiates against.  The module-level functions such as
+    :func:`register_text_type` operate on the default registry that
+    is used unless the application includes a registry in its
+    ``content_registry`` setting::
+
+        registry = content.ContentRegistry()
+        registry.register_text_type('application/json', 'utf-8',
+                                    json.dumps, json.loads)
+        app = web.Application(handlers, content_registry=registry)
 
-    :param str content_type: content type to register the hooks for
-    :param dumper: called to decode bytes into a dictionary.
-        Calling convention: ``dumper(obj_dict) -> bytes``.
-    :param loader: called to encode a dictionary into a byte string.
-        Calling convention: ``loader(obj_bytes) -> dict``
+    Using a registry per application keeps the negotiated set small
+    and isolates applications (and tests) from each other.
 
     """
-    content_type = headers.parse_content_type(content_type)
-    content_type.parameters.clear()
-    key = str(content_type)
-    _content_types[key] = content_type
 
-    handler = _content_handlers.setdefault(key, _ContentHandler(key))
-    handler.dict_to_bytes = dumper
-    handler.bytes_to_dict = loader
+    def __init__(self, negotiation_cache_size=128, metrics=None,
+                 default_content_type=None):
+        super(ContentRegistry, self).__init__()
+        self.metrics = metrics
+        self._content_handlers = {}
+        self._content_types = {}
+        self._default_content_type = None
+        self._default_response = None
+        self._generation = 0
+        self._negotiation_cache = _LRUCache(negotiation_cache_size)
+        self._negotiator = None
+        if default_content_type is not None:
+            self.default_content_type = default_content_type
 
+    @property
+    def content_types(self):
+        """Yields the currently registered content types in some order."""
+        for content_type in self._content_types.keys():
+            yield content_type
+
+    @property
+    def default_content_type(self):
+        """
+        Content type to respond with when any type is acceptable.
+
+        Requests that do not include an :mailheader:`Accept` header or
+        that send ``Accept: */*`` are answered with this content type
+        without parsing or negotiating the header.  This is the usual
+        case for service-to-service traffic.  It has no effect until the
+        content type is registered.  Setting this to :data:`None`
+        negotiates these requests like any other.
+
+        :raises: :exc:`RuntimeError` when it is assigned after the
+            registry is frozen
+
+        """
+        return self._default_content_type
+
+    @default_content_type.setter
+    def default_content_type(self, content_type):
+        self._check_mutable()
+        if content_type is not None:
+            content_type = headers.parse_content_type(content_type)
+            content_type.parameters.clear()
+            content_type = str(content_type)
+        self._default_content_type = content_type
+        self._changed()
+
+    @property
+    def frozen(self):
+        """Has :meth:`freeze` been called?"""
+        return self._negotiator is not None
+
+    def freeze(self):
+        """
+        Prevent further changes and compile the negotiation table.
+
+        Most applications register their content types when they start
+        and never change them afterwards.  Freezing the registry lets it
+        sort and index the registered types once instead of sorting them
+        and comparing them with every media range each time that an
+        :mailheader:`Accept` header is negotiated.  Freezing does not
+        change which type is selected.
+
+        Registering content types or clearing the registry after it is
+        frozen raises :exc:`RuntimeError`.  Freezing a frozen registry
+        does nothing.
+
+        """
+        if self._negotiator is None:
+            self._negotiator = _CompiledNegotiator(self._content_types)
+            self._changed()
+
+    def register_text_type(self, content_type, default_encoding, dumper,
+                           loader, incremental_loader=None,
+                           stream_dumper=None, executor=None,
+                           offload_threshold=0, record_loader=None,
+                           typed_loader=None):
+        """
+        Register handling for a text-based content type.
+
+        :param str content_type: content type to register the hooks for
+        :param str default_encoding: encoding to use if none is present
+            in the request
+        :param dumper: called to decode a string into a dictionary.
+            Calling convention: ``dumper(obj_dict).encode(encoding) -> bytes``
+        :param loader: called to encode a dictionary to a string.
+            Calling convention: ``loader(obj_bytes.decode(encoding)) -> dict``
+        :param incremental_loader: optional factory for incremental
+            decoders that is used by :class:`StreamingHandlerMixin`.
+            Calling convention: ``incremental_loader()`` returns an object
+            with ``feed(str)`` and ``close() -> dict`` methods
+        :param stream_dumper: optional hook that is used by
+            :meth:`HandlerMixin.send_response_stream`.
+            Calling convention: ``stream_dumper(iterable)`` returns an
+            iterable of strings
+        :param concurrent.futures.Executor executor: optional executor
+            that the asynchronous :class:`HandlerMixin` methods use to
+            run `dumper` and `loader`
+        :param int offload_threshold: request bodies smaller than this
+            number of bytes are decoded on the IOLoop even if `executor`
+            is specified
+        :param record_loader: optional factory for record decoders that
+            is used by :meth:`HandlerMixin.get_request_records`.
+            Calling convention: ``record_loader()`` returns an object
+            with ``feed(str) -> iterable`` and ``close() -> iterable``
+            methods that return the records completed so far.
+            :func:`line_records` creates one for newline-delimited text.
+        :param typed_loader: optional hook that decodes and validates a
+            body into the :attr:`HandlerMixin.request_body_type` in one
+            step.  It should raise :exc:`ValueError` for invalid bodies.
+            Calling convention: ``typed_loader(str, body_type) -> object``
+
+        The decoding of a text content body takes into account decoding
+        the binary request body into a string before calling the
+        underlying dump/load routines.
+
+        :raises: :exc:`ValueError` if `typed_loader` is specified and
+            structure limits are set for the content type
+        :raises: :exc:`RuntimeError` if the registry is frozen
+
+        """
+        handler = self._get_or_create_handler(content_type)
+        if typed_loader is not None and handler.checks_structure:
+            raise _typed_limits_error(handler.content_type)
+        handler.dict_to_string = dumper
+        handler.string_to_dict = loader
+        handler.incremental_string_loader = incremental_loader
+        handler.iterable_to_strings = stream_dumper
+        handler.record_string_loader = record_loader
+        handler.typed_string_loader = typed_loader
+        handler.default_encoding = (default_encoding or
+                                    handler.default_encoding)
+        if executor is not None:
+            handler.executor = executor
+            handler.offload_threshold = offload_threshold
+        self._changed()
+
+    def register_binary_type(self, content_type, dumper, loader,
+                             incremental_loader=None, stream_dumper=None,
+                             accepts_buffer=False, native_strings=False,
+                             executor=None, offload_threshold=0,
+                             record_loader=None, typed_loader=None):
+        """
+        Register handling for a binary content type.
+
+        :param str content_type: content type to register the hooks for
+        :param dumper: called to decode bytes into a dictionary.
+            Calling convention: ``dumper(obj_dict) -> bytes``.
+        :param loader: called to encode a dictionary into a byte string.
+            Calling convention: ``loader(obj_bytes) -> dict``
+        :param incremental_loader: optional factory for incremental
+            decoders that is used by :class:`StreamingHandlerMixin`.
+            Calling convention: ``incremental_loader()`` returns an object
+            with ``feed(bytes)`` and ``close() -> dict`` methods
+        :param stream_dumper: optional hook that is used by
+            :meth:`HandlerMixin.send_response_stream`.
+            Calling convention: ``stream_dumper(iterable)`` returns an
+            iterable of byte strings
+        :param bool accepts_buffer: set this if `loader` accepts any
+            buffer object.  The request body is passed as a
+            :class:`memoryview` instead of :class:`bytes`.
+        :param bool native_strings: set this if `loader` produces
+            :class:`str` instances instead of byte strings (e.g., msgpack
+            with ``raw=False``).  This skips the pass over the decoded
+            body that converts byte strings into text.
+        :param concurrent.futures.Executor executor: optional executor
+            that the asynchronous :class:`HandlerMixin` methods use to
+            run `dumper` and `loader`
+        :param int offload_threshold: request bodies smaller than this
+            number of bytes are decoded on the IOLoop even if `executor`
+            is specified
+        :param record_loader: optional factory for record decoders that
+            is used by :meth:`HandlerMixin.get_request_records`.
+            Calling convention: ``record_loader()`` returns an object
+            with ``feed(bytes) -> iterable`` and ``close() -> iterable``
+            methods that return the records completed so far
+        :param typed_loader: optional hook that decodes and validates a
+            body into the :attr:`HandlerMixin.request_body_type` in one
+            step.  It should raise :exc:`ValueError` for invalid bodies.
+            Calling convention: ``typed_loader(bytes, body_type) -> object``
+        :raises: :exc:`ValueError` if `typed_loader` is specified and
+            structure limits are set for the content type
+        :raises: :exc:`RuntimeError` if the registry is frozen
+
+        """
+        handler = self._get_or_create_handler(content_type)
+        if typed_loader is not None and handler.checks_structure:
+            raise _typed_limits_error(handler.content_type)
+        handler.dict_to_bytes = dumper
+        handler.bytes_to_dict = loader
+        handler.incremental_bytes_loader = incremental_loader
+        handler.iterable_to_bytes = stream_dumper
+        handler.record_bytes_loader = record_loader
+        handler.typed_bytes_loader = typed_loader
+        handler.accepts_buffer = accepts_buffer
+        handler.native_strings = native_strings
+        if executor is not None:
+            handler.executor = executor
+            handler.offload_threshold = offload_threshold
+        self._changed()
+
+    def set_request_limits(self, content_type, max_body_size=None,
+                           max_depth=None, max_elements=None):
+        """
+        Limit the request bodies that are decoded for a content type.
+
+        :param str content_type: the registered content type
+        :param int max_body_size: maximum size of the request body in
+            bytes
+        :param int max_depth: maximum nesting depth of the decoded body.
+            The body itself is at a depth of one.
+        :param int max_elements: maximum number of values contained in
+            the lists and dictionaries of the decoded body
+        :raises: :exc:`ValueError` if `content_type` is not registered
+            or if `max_depth` or `max_elements` is set for a content
+            type that has a typed loader
+        :raises: :exc:`RuntimeError` if the registry is frozen
+
+        Request bodies that exceed a limit are rejected with a *413
+        Request Entity Too Large* response and are reported to
+        :meth:`ContentMetrics.limit_exceeded`.  The body size is checked
+        before decoding starts using the :mailheader:`Content-Length`
+        header when the body is streamed.  The decoded body is only
+        walked when `max_depth` or `max_elements` is set.  A typed
+        loader produces objects that cannot be walked, so only
+        `max_body_size` can be set for content types that have one.
+        Limits that are :data:`None` are not enforced.
+
+        """
+        self._check_mutable()
+        key = headers.parse_content_type(content_type)
+        key.parameters.clear()
+        try:
+            handler = self._content_handlers[str(key)]
+        except KeyError:
+            raise ValueError('{0} is not registered'.format(key))
+        if handler.has_typed_loader and (max_depth is not None or
+                                         max_elements is not None):
+            raise _typed_limits_error(key)
+        handler.max_body_size = max_body_size
+        handler.max_depth = max_depth
+        handler.max_elements = max_elements
+
+    def clear_handlers(self):
+        """
+        Clears registered type handlers.
+
+        :raises: :exc:`RuntimeError` if the registry is frozen
+
+        """
+        self._check_mutable()
+        self._content_handlers.clear()
+        self._content_types.clear()
+        self._changed()
+
+    def negotiation_cache_info(self):
+        """
+        Report on the effectiveness of the content negotiation cache.
+
+        :return: a :data:`CacheInfo` instance containing the number of
+            cache hits and misses, the maximum size of the cache, and
+            the current number of entries
+
+        :meth:`HandlerMixin.send_response` memoizes the result of
+        negotiating each distinct :mailheader:`Accept` header.  The
+        statistics are reset whenever the set of registered content
+        types changes.
+
+        """
+        return self._negotiation_cache.info()
+
+    def _check_mutable(self):
+        if self._negotiator is not None:
+            raise RuntimeError('content registry is frozen')
+
+    def _get_or_create_handler(self, content_type):
+        self._check_mutable()
+        content_type = headers.parse_content_type(content_type)
+        content_type.parameters.clear()
+        key = str(content_type)
+        self._content_types[key] = content_type
+        return self._content_handlers.setdefault(key, _ContentHandler(key))
+
+    def _changed(self):
+        """Invalidate anything derived from the registered content types."""
+        self._generation += 1
+        self._negotiation_cache.clear()
+        self._default_response = None
+        handler = self._content_handlers.get(self._default_content_type)
+        if handler is not None:
+            self._default_response = (
+                self._content_types[self._default_content_type], handler)
+
+    def _select_response_type(self, accept_header):
+        """
+        Select the response content type for an :mailheader:`Accept` header.
+
+        :param str accept_header: the raw header value
+        :return: a :class:`tuple` of the selected
+            :class:`~ietfparse.datastructures.ContentType` and the
+            :class:`_ContentHandler` that implements it or :data:`None`
+            if no registered content type is acceptable
+
+        The result is memoized in a bounded LRU cache keyed on the raw
+        header value and the registry generation so that re-parsing and
+        negotiating the same header is avoided.  Changing the registered
+        content types bumps the generation and empties the cache.
+        Frozen registries negotiate using the compiled table.  The
+        :attr:`default_content_type` is returned for ``*/*`` without
+        consulting the cache.
+
+        """
+        if accept_header == '*/*' and self._default_response is not None:
+            return self._default_response
+        key = (self._generation, accept_header)
+        result = self._negotiation_cache.get(key, _MISSING)
+        if result is _MISSING and self._negotiator is not None:
+            selected = self._negotiator.select(accept_header)
+            if selected is not None:
+                result = selected, self._content_handlers[str(selected)]
+            else:
+                result = None
+            self._negotiation_cache.put(key, result)
+        elif result is _MISSING:
+            accept = headers.parse_http_accept_header(accept_header)
+            try:
+                selected, _ = algorithms.select_content_type(
+                    accept, self._content_types.values())
+                result = selected, self._content_handlers[str(selected)]
+            except errors.NoMatch:
+                result = None
+            self._negotiation_cache.put(key, result)
+        return result
+
+    def _select_request_handler(self, content_type_str):
+        """
+        Select the handler for a :mailheader:`Content-Type` header.
+
+        :param str content_type_str: the raw header value
+        :return: a :class:`tuple` of the :class:`_ContentHandler` and the
+            ``charset`` parameter from the header (or :data:`None`)
+        :raises: :class:`ietfparse.errors.NoMatch` if no registered
+            content type matches
+
+        Request content types are almost always exact matches for one of
+        the registered types so the media type is looked up directly in
+        the handler table.  The header is only parsed when it includes
+        parameters and full negotiation is only performed when the
+        direct lookup fails.
+
+        """
+        media_type, _, parameters = content_type_str.partition(';')
+        handler = self._content_handlers.get(media_type.strip().lower())
+        if handler is not None:
+            if not parameters:
+                return handler, None
+            content_type = headers.parse_content_type(content_type_str)
+            return handler, content_type.parameters.get('charset')
+
+        content_type = headers.parse_content_type(content_type_str)
+        selected, _ = algorithms.select_content_type(
+            [content_type], self._content_types.values())
+        return (self._content_handlers[str(selected)],
+                content_type.parameters.get('charset'))
 
-def clear_handlers():
-    """Clears registered type handlers."""
-    _content_handlers.clear()
-    _content_types.clear()
+
+default_registry = ContentRegistry()
+"""The registry that is used when an application does not supply one."""
+
+register_text_type = default_registry.register_text_type
+register_binary_type = default_registry.register_binary_type
+set_request_limits = default_registry.set_request_limits
+clear_handlers = default_registry.clear_handlers
+negotiation_cache_info = default_registry.negotiation_cache_info
 
 
 class HandlerMixin(object):
     """
     Mix this in over ``RequestHandler`` to enable content handling.
+
+    .. attribute:: response_chunk_size
+
+       Number of bytes that :meth:`send_response_stream` accumulates
+       before flushing them to the client.
+
+    .. attribute:: record_chunk_size
+
+       Number of request body bytes that :meth:`get_request_records`
+       passes to the record loader at a time.
+
+    .. attribute:: compress_responses
+
+       Set this to enable :mailheader:`Accept-Encoding` negotiation
+       in :meth:`send_response`.  This is disabled by default.
+
+    .. attribute:: compression_threshold
+
+       Responses smaller than this number of bytes are never
+       compressed.
+
+    .. attribute:: compression_level
+
+       Compression level that is passed to :mod:`zlib`.
+
+    .. attribute:: content_codings
+
+       Content codings to offer in order of preference.  The ``br``
+       and ``zstd`` codings are only available if the :mod:`brotli`
+       and :mod:`zstandard` modules are installed.
+
+    .. attribute:: compression_executor
+
+       Optional :class:`concurrent.futures.Executor` that compresses
+       responses.  If this is set, then :meth:`send_response` returns
+       a future that **must** be yielded before the request is
+       finished.
+
+    .. attribute:: request_body_type
+
+       Optional type that :meth:`get_request_body` decodes the request
+       body into instead of a :class:`dict`.  The typed loader that is
+       registered for the content type creates the instance directly.
+       Otherwise, the type is called with the members of the decoded
+       body as keyword parameters.
+
+    .. attribute:: response_cache
+
+       Optional :class:`ResponseCache` that :meth:`send_response`
+       stores encoded responses in when it is called with a
+       ``cache_key``.
+
     """
 
+    response_chunk_size = 16 * 1024
+    record_chunk_size = 64 * 1024
+    compress_responses = False
+    compression_threshold = 1024
+    compression_level = 6
+    content_codings = ('gzip', 'deflate', 'br', 'zstd')
+    compression_executor = None
+    request_body_type = None
+    response_cache = None
+
+    _content_registry = None
+
     def __init__(self, *args, **kwargs):
         super(HandlerMixin, self).__init__(*args, **kwargs)
         self._request_body = None
 
+    @property
+    def content_registry(self):
+        """
+        The :class:`ContentRegistry` that this handler negotiates with.
+
+        This is the ``content_registry`` application setting if it is
+        present or :data:`default_registry` otherwise.  It can also be
+        assigned to use a specific registry in a single handler.
+
+        """
+        if self._content_registry is None:
+            self._content_registry = self.settings.get('content_registry',
+                                                       default_registry)
+        return self._content_registry
+
+    @content_registry.setter
+    def content_registry(self, registry):
+        self._content_registry = registry
+
     @property
     def registered_content_types(self):
         """Yields the currently registered content types in some order."""
-        for content_type in _content_types.keys():
-            yield content_type
+        return self.content_registry.content_types
 
     def get_request_body(self):
         """
@@ -151,34 +1558,236 @@ class HandlerMixin(object):
 
         """
         if self._request_body is None:
-            content_type_str = self.request.headers.get(
-                'Content-Type', 'application/octet-stream')
-            LOGGER.debug('decoding request body of type %s', content_type_str)
-            content_type = headers.parse_content_type(content_type_str)
+            handler, charset, body_type = self._start_request_body()
+            self._request_body = self._decode_request_body(
+                handler, charset, body_type)
+        return self._request_body
+
+    @gen.coroutine
+    def get_request_body_async(self):
+        """
+        Decodes the request body, possibly using an executor.
+
+        :return: the decoded request body as a :class:`dict` instance.
+        :raises: :class:`tornado.web.HTTPError` if the body cannot be
+            decoded (415) or if decoding fails (400)
+
+        This coroutine behaves like :meth:`get_request_body` except that
+        the body is decoded on the executor that was registered for the
+        content type when the body is at least as large as the registered
+        ``offload_threshold``.  This keeps large bodies from stalling
+        the IOLoop.
+
+        """
+        if self._request_body is None:
+            handler, charset, body_type = self._start_request_body()
+            body = self.request.body
+            if handler.should_offload(len(body)):
+                if __debug__ and _debug_enabled():
+                    LOGGER.debug('offloading decoding of %d bytes',
+                                 len(body))
+                start = timeit.default_timer()
+                try:
+                    decoded = yield handler.executor.submit(
+                        _unpack_bytes, handler, body, charset, body_type)
+                except ValueError as error:
+                    raise _decode_failure(error)
+                self._request_body = self._finish_request_body(
+                    handler, decoded, body_type, len(body),
+                    timeit.default_timer() - start)
+            else:
+                self._request_body = self._decode_request_body(
+                    handler, charset, body_type)
+        raise gen.Return(self._request_body)
+
+    def get_request_records(self):
+        """
+        Decodes the request body as a sequence of records.
+
+        :return: a generator that yields each decoded record
+        :raises: :class:`tornado.web.HTTPError` if the body cannot be
+            decoded (415) or if decoding fails (400).  Since this is a
+            generator, the errors are raised while iterating.
+
+        The request body is passed to the record loader that was
+        registered for the content type :attr:`record_chunk_size` bytes
+        at a time and the records are yielded as they are completed.
+        This lets bulk endpoints process each record without building a
+        list of every record in the body.  If the content type does not
+        have a record loader, then the body is decoded as usual and the
+        elements are yielded if it is a list.
+
+        Unlike :meth:`get_request_body`, the records are not retained
+        so the generator can only be consumed once.
+
+        """
+        handler, charset = self._get_request_handler()
+        if not (handler.record_bytes_loader or handler.record_string_loader):
+            for record in self._iterate_request_body():
+                yield record
+            return
+        self._check_request_limit(
+            handler, handler.check_body_size(self._get_request_size()))
+
+        metrics = self.content_registry.metrics
+        elapsed, num_bytes = 0.0, 0
+        unpacker = handler.start_unpacking_records(charset)
+        chunks = self._get_request_chunks()
+        while unpacker is not None:
+            if metrics is not None:
+                start = timeit.default_timer()
+            chunk = next(chunks, None)
             try:
-                selected, requested = algorithms.select_content_type(
-                    [content_type], _content_types.values())
-            except errors.NoMatch:
-                raise web.HTTPError(
-                    415, 'cannot decoded content type %s', content_type_str,
-                    reason='Unexpected content type')
-            handler = _content_handlers[str(selected)]
+                if chunk is None:
+                    records, unpacker = unpacker.close(), None
+                else:
+                    records = unpacker.feed(chunk)
+                    num_bytes += len(chunk)
+            except ValueError as error:
+                raise _decode_failure(error)
+            if metrics is not None:
+                elapsed += timeit.default_timer() - start
+            for record in records:
+                self._check_request_limit(handler,
+                                          handler.check_structure(record))
+                yield record
+        if metrics is not None:
+            metrics.decoded(handler.content_type, num_bytes, elapsed)
+
+    def _iterate_request_body(self):
+        body = self.get_request_body()
+        if isinstance(body, list):
+            for record in body:
+                yield record
+        else:
+            yield body
+
+    def _get_request_size(self):
+        return len(self.request.body)
+
+    def _get_typed_body_type(self, handler):
+        """Return the type for the typed loader of `handler` if any."""
+        if handler.has_typed_loader:
+            return self.request_body_type
+        return None
+
+    def _start_request_body(self):
+        """
+        Select the request content handler and check the body size.
+
+        :return: a :class:`tuple` of the :class:`_ContentHandler`, the
+            requested character set, and the type to pass to the typed
+            loader (or :data:`None`)
+        :raises: :class:`tornado.web.HTTPError` if the body cannot be
+            decoded (415) or is too large (413)
+
+        """
+        handler, charset = self._get_request_handler()
+        self._check_request_limit(
+            handler, handler.check_body_size(len(self.request.body)))
+        return handler, charset, self._get_typed_body_type(handler)
+
+    def _decode_request_body(self, handler, charset, body_type):
+        """Decode the buffered request body on the IOLoop."""
+        start = timeit.default_timer()
+        try:
+            body = handler.unpack_bytes(self.request.body, encoding=charset,
+                                        body_type=body_type)
+        except ValueError as error:
+            raise _decode_failure(error)
+        return self._finish_request_body(handler, body, body_type,
+                                         len(self.request.body),
+                                         timeit.default_timer() - start)
+
+    def _finish_request_body(self, handler, body, body_type, num_bytes,
+                             elapsed):
+        """
+        Check the limits of a decoded body and convert it if necessary.
+
+        :param _ContentHandler handler: the request content handler
+        :param body: the decoded body
+        :param type body_type: the type that was passed to the typed
+            loader or :data:`None` if `body` was not created by one
+        :param int num_bytes: size of the encoded body
+        :param float elapsed: seconds that it took to decode the body
+        :return: `body` or an instance of :attr:`request_body_type`
+            that was created from it
+        :raises: :class:`tornado.web.HTTPError` if the body exceeds a
+            limit (413) or cannot be converted (400)
+
+        """
+        metrics = self.content_registry.metrics
+        if metrics is not None:
+            metrics.decoded(handler.content_type, num_bytes, elapsed)
+        self._check_request_limit(handler, handler.check_structure(body))
+        if self.request_body_type is not None and body_type is None:
             try:
-                self._request_body = handler.unpack_bytes(
-                    self.request.body,
-                    encoding=content_type.parameters.get('charset'),
-                )
+                body = handler.build_typed(body, self.request_body_type)
             except ValueError as error:
-                raise web.HTTPError(
-                    400, 'failed to decode content body - %r', error,
-                    reason='Content body decode failure')
-        return self._request_body
+                raise _decode_failure(error)
+        return body
+
+    def _check_request_limit(self, handler, limit):
+        """
+        Reject the request if it exceeded a limit.
+
+        :param _ContentHandler handler: the request content handler
+        :param str limit: the name of the exceeded limit as returned
+            from :meth:`_ContentHandler.check_body_size` or
+            :meth:`_ContentHandler.check_structure`.  Nothing happens
+            if this is :data:`None`.
+        :raises: :class:`tornado.web.HTTPError` (413)
+
+        """
+        if limit is None:
+            return
+        metrics = self.content_registry.metrics
+        if metrics is not None:
+            metrics.limit_exceeded(handler.content_type, limit)
+        raise web.HTTPError(413, 'request body exceeds %s for %s',
+                            limit, handler.content_type,
+                            reason='Request Entity Too Large')
 
-    def send_response(self, response_dict):
+    def _get_request_chunks(self):
+        """Yield the request body in :attr:`record_chunk_size` pieces."""
+        body, size = self.request.body, self.record_chunk_size
+        for offset in range(0, len(body), size):
+            yield body[offset:offset + size]
+
+    def _get_request_handler(self):
+        """
+        Select the content handler for the request body.
+
+        :return: a :class:`tuple` of the :class:`_ContentHandler` and
+            the requested character set
+        :raises: :class:`tornado.web.HTTPError` if the body cannot be
+            decoded (415)
+
+        """
+        content_type_str = self.request.headers.get(
+            'Content-Type', 'application/octet-stream')
+        if __debug__ and _debug_enabled():
+            LOGGER.debug('decoding request body of type %s', content_type_str,
+                         extra={'content_type': content_type_str})
+        try:
+            return self.content_registry._select_request_handler(
+                content_type_str)
+        except errors.NoMatch:
+            raise web.HTTPError(
+                415, 'cannot decoded content type %s', content_type_str,
+                reason='Unexpected content type')
+
+    def send_response(self, response_dict, cache_key=None):
         """
         Encode a response according to the request.
 
         :param dict response_dict: the response to send
+        :param cache_key: optional hashable value that identifies
+            `response_dict` in the :attr:`response_cache`
+        :return: :data:`None` unless the response is being compressed
+            by the :attr:`compression_executor`.  In that case, a
+            future is returned that resolves once the response has
+            been written.
 
         :raises: :class:`tornado.web.HTTPError` if no acceptable content
             type exists
@@ -189,34 +1798,456 @@ class HandlerMixin(object):
         ``self.write`` after setting the response content type using
         ``self.set_header``.
 
+        If :attr:`compress_responses` is enabled, then responses that are
+        at least :attr:`compression_threshold` bytes are compressed using
+        the content coding negotiated from the :mailheader:`Accept-Encoding`
+        request header.
+
+        If a :attr:`response_cache` is configured and `cache_key` is
+        specified, then the encoded response is retrieved from the cache
+        instead of encoding `response_dict` again.  The cached entity tag
+        is sent in the :mailheader:`ETag` header and a *GET* or *HEAD*
+        request with a matching :mailheader:`If-None-Match` header receives
+        a *304 Not Modified* response without a body.  Call
+        :meth:`ResponseCache.invalidate` with the same key when the
+        resource changes.
+
         """
-        accept = headers.parse_http_accept_header(
-            self.request.headers.get('Accept', '*/*'))
-        try:
-            selected, _ = algorithms.select_content_type(
-                accept, _content_types.values())
-        except errors.NoMatch:
+        return self._send_response(response_dict, cache_key, offload=False)
+
+    @gen.coroutine
+    def send_response_async(self, response_dict, offload=None,
+                            cache_key=None):
+        """
+        Encode a response, possibly using an executor.
+
+        :param dict response_dict: the response to send
+        :param bool offload: optionally force the encoding onto (or off
+            of) the registered executor
+        :param cache_key: optional hashable value that identifies
+            `response_dict` in the :attr:`response_cache`
+
+        :raises: :class:`tornado.web.HTTPError` if no acceptable content
+            type exists
+
+        This coroutine behaves like :meth:`send_response` except that the
+        response is encoded on the executor that was registered for the
+        negotiated content type.  Since the size of the encoded response
+        is not known ahead of time, encoding is offloaded whenever an
+        executor is registered unless `offload` is :data:`False`.
+        Cached responses are sent without using the executor.
+
+        """
+        future = self._send_response(response_dict, cache_key, offload)
+        if future is not None:
+            yield future
+
+    def _send_response(self, response_dict, cache_key, offload):
+        """
+        Negotiate, encode, and write a response.
+
+        :param dict response_dict: the response to send
+        :param cache_key: optional :attr:`response_cache` key
+        :param bool offload: encode on the registered executor?  If
+            this is :data:`None`, then the content handler decides.
+        :return: a future if the encoding or compression was handed
+            off to an executor or :data:`None`
+
+        """
+        handler, charsets, refused = self._get_response_handler()
+        cache_key = self._get_response_cache_key(cache_key, handler,
+                                                 charsets, refused)
+        cached = self._get_cached_response(cache_key)
+        if cached is not None:
+            return self._write_cached_response(handler, cached)
+
+        if offload is None:
+            offload = handler.should_offload()
+        if offload and handler.executor is not None:
+            return self._send_offloaded_response(handler, charsets, refused,
+                                                 response_dict, cache_key)
+        start = timeit.default_timer()
+        encoding, response_bytes = handler.pack_bytes(
+            response_dict, charsets[0], charsets[1:], refused)
+        return self._write_encoded_response(
+            handler, cache_key, encoding, response_bytes,
+            timeit.default_timer() - start)
+
+    @gen.coroutine
+    def _send_offloaded_response(self, handler, charsets, refused,
+                                 response_dict, cache_key):
+        if __debug__ and _debug_enabled():
+            LOGGER.debug('offloading encoding using %r', handler)
+        start = timeit.default_timer()
+        encoding, response_bytes = yield handler.executor.submit(
+            _pack_bytes, handler, response_dict, charsets[0], charsets[1:],
+            refused)
+        future = self._write_encoded_response(
+            handler, cache_key, encoding, response_bytes,
+            timeit.default_timer() - start)
+        if future is not None:
+            yield future
+
+    def _write_encoded_response(self, handler, cache_key, encoding,
+                                response_bytes, elapsed):
+        """
+        Record, cache, and write a freshly encoded response.
+
+        :param _ContentHandler handler: the negotiated content handler
+        :param cache_key: :attr:`response_cache` key or :data:`None`
+        :param str encoding: character set of `response_bytes`
+        :param bytes response_bytes: the encoded response body
+        :param float elapsed: seconds that it took to encode the body
+        :return: a future if the compression was handed off to the
+            :attr:`compression_executor` or :data:`None`
+
+        """
+        metrics = self.content_registry.metrics
+        if metrics is not None:
+            metrics.encoded(handler.content_type, len(response_bytes),
+                            elapsed)
+        if cache_key is not None:
+            cached = self.response_cache.put(cache_key, encoding,
+                                             response_bytes)
+            return self._write_cached_response(handler, cached)
+        self.set_header('Content-Type',
+                        handler.get_content_type_header(encoding))
+        return self._write_response_bytes(response_bytes)
+
+    def _get_response_cache_key(self, cache_key, handler, charsets,
+                                refused):
+        if cache_key is None or self.response_cache is None:
+            return None
+        return cache_key, handler.content_type, charsets, refused
+
+    def _get_cached_response(self, cache_key):
+        if cache_key is None:
+            return None
+        return self.response_cache.get(cache_key)
+
+    def _write_cached_response(self, handler, cached):
+        """
+        Write a response from the :attr:`response_cache`.
+
+        :param _ContentHandler handler: the negotiated content handler
+        :param cached: the cached response
+        :return: a future if the compression was handed off to the
+            :attr:`compression_executor` or :data:`None`
+
+        The :mailheader:`ETag` header is set and a *304 Not Modified*
+        response is generated for *GET* and *HEAD* requests if it matches
+        the :mailheader:`If-None-Match` request header.  The content
+        coding is included in the entity tag of compressed responses so
+        that each coding has its own tag.
+
+        """
+        self.set_header('Content-Type',
+                        handler.get_content_type_header(cached.encoding))
+        coding = self._select_response_coding(cached.body)
+        if coding is None:
+            self.set_header('Etag', cached.etag)
+        else:
+            self.set_header('Etag', cached.etag[:-1] + '-' + coding + '"')
+        if (self.request.method in ('GET', 'HEAD') and
+                self.check_etag_header()):
+            if self.compress_responses:
+                self.add_header('Vary', 'Accept-Encoding')
+            self.set_status(304)
+            return None
+        return self._write_response_bytes(cached.body, coding)
+
+    def _select_response_coding(self, response_bytes):
+        """
+        Select the content coding for an encoded response.
+
+        :param bytes response_bytes: the encoded response body
+        :return: the name of the coding or :data:`None` if the response
+            should not be compressed
+
+        """
+        if (not self.compress_responses or
+                len(response_bytes) < self.compression_threshold):
+            return None
+        return _select_content_coding(
+            self.request.headers.get('Accept-Encoding', ''),
+            [name for name in self.content_codings
+             if name in _content_codings])
+
+    def _write_response_bytes(self, response_bytes, coding=_MISSING):
+        """
+        Write an encoded response, compressing it if appropriate.
+
+        :param bytes response_bytes: the encoded response body
+        :param str coding: the content coding if it has already been
+            selected by :meth:`_select_response_coding`
+        :return: a future if the compression was handed off to the
+            :attr:`compression_executor` or :data:`None`
+
+        """
+        if not self.compress_responses:
+            self.write(response_bytes)
+            return None
+
+        self.add_header('Vary', 'Accept-Encoding')
+        if coding is _MISSING:
+            coding = self._select_response_coding(response_bytes)
+        if coding is None:
+            self.write(response_bytes)
+            return None
+
+        if __debug__ and _debug_enabled():
+            LOGGER.debug('compressing %d byte response using %s',
+                         len(response_bytes), coding,
+                         extra={'num_bytes': len(response_bytes),
+                                'coding': coding})
+        self.set_header('Content-Encoding', coding)
+        compress = _content_codings[coding]
+        if self.compression_executor is None:
+            self.write(compress(response_bytes, self.compression_level))
+            return None
+        return self._write_compressed(compress, response_bytes)
+
+    @gen.coroutine
+    def _write_compressed(self, compress, response_bytes):
+        compressed = yield self.compression_executor.submit(
+            compress, response_bytes, self.compression_level)
+        self.write(compressed)
+
+    @gen.coroutine
+    def send_response_stream(self, iterable):
+        """
+        Encode a response incrementally according to the request.
+
+        :param iterable: the objects to send
+
+        :raises: :class:`tornado.web.HTTPError` if no acceptable content
+            type exists
+
+        This method negotiates the response content type in the same
+        manner as :meth:`send_response` and then writes the chunks
+        produced by the registered streaming dumper as `iterable` is
+        consumed.  The output is flushed to the client each time
+        :attr:`response_chunk_size` bytes have accumulated so that the
+        client starts receiving data before the entire response is
+        encoded.  If the negotiated type does not have a streaming
+        dumper, then `iterable` is encoded as a list in one shot.
+
+        This method is a coroutine and should be yielded before the
+        request is finished.
+
+        """
+        handler, charsets, refused = self._get_response_handler()
+        metrics = self.content_registry.metrics
+        if metrics is not None:
+            start, flushing = timeit.default_timer(), 0.0
+        encoding, chunks = handler.pack_stream(iterable, charsets[0],
+                                               charsets[1:], refused)
+        self.set_header('Content-Type',
+                        handler.get_content_type_header(encoding))
+        pending, total = 0, 0
+        for chunk in chunks:
+            if chunk:
+                self.write(chunk)
+                pending += len(chunk)
+                total += len(chunk)
+                if pending >= self.response_chunk_size:
+                    pending = 0
+                    if metrics is not None:
+                        flush_start = timeit.default_timer()
+                    yield self.flush()
+                    if metrics is not None:
+                        flushing += timeit.default_timer() - flush_start
+        if metrics is not None:
+            metrics.encoded(handler.content_type, total,
+                            timeit.default_timer() - start - flushing)
+        if pending:
+            yield self.flush()
+
+    def _get_response_handler(self):
+        """
+        Select the content handler and character set for the response.
+
+        :return: a :class:`tuple` of the :class:`_ContentHandler`, a
+            :class:`tuple` of the acceptable character sets in order
+            of preference, and a :class:`frozenset` of the refused
+            character sets.  :data:`None` represents the default
+            encoding of the content type.
+        :raises: :class:`tornado.web.HTTPError` if no acceptable content
+            type exists (406)
+
+        """
+        registry = self.content_registry
+        metrics = registry.metrics
+        if metrics is not None:
+            start = timeit.default_timer()
+        accept = self.request.headers.get('Accept', '*/*')
+        result = registry._select_response_type(accept)
+        if result is None:
             raise web.HTTPError(406,
                                 'no acceptable content type for %s in %r',
-                                accept, _content_types.values(),
+                                accept, list(registry.content_types),
                                 reason='Content Type Not Acceptable')
 
-        LOGGER.debug('selected %s as outgoing content type', selected)
-        handler = _content_handlers[str(selected)]
-
-        accept = self.request.headers.get('Accept-Charset', '*')
-        charsets = headers.parse_accept_charset(accept)
-        charset = charsets[0] if charsets[0] != '*' else None
-        LOGGER.debug('encoding response body using %r with encoding %s',
-                     handler, charset)
-        encoding, response_bytes = handler.pack_bytes(response_dict,
-                                                      encoding=charset)
-
-        if encoding:  # don't overwrite the value in _content_types
-            copied = datastructures.ContentType(selected.content_type,
-                                                selected.content_subtype,
-                                                selected.parameters)
-            copied.parameters['charset'] = encoding
-            selected = copied
-        self.set_header('Content-Type', str(selected))
-        self.write(response_bytes)
+        selected, handler = result
+        if __debug__ and _debug_enabled():
+            LOGGER.debug('selected %s as outgoing content type', selected,
+                         extra={'content_type': handler.content_type})
+
+        charsets, refused = (None,), frozenset()
+        accept = self.request.headers.get('Accept-Charset')
+        if accept is not None and accept != '*':
+            charsets, refused = _select_charsets(accept)
+        if metrics is not None:
+            metrics.negotiated(handler.content_type,
+                               timeit.default_timer() - start)
+        if __debug__ and _debug_enabled():
+            LOGGER.debug('encoding response body using %r with encoding %s',
+                         handler, charsets[0],
+                         extra={'content_type': handler.content_type,
+                                'encoding': charsets[0]})
+        return handler, charsets, refused
+
+
+class StreamingHandlerMixin(HandlerMixin):
+    """
+    Mix this in over a streaming ``RequestHandler``.
+
+    This variant of :class:`HandlerMixin` decodes the request body as
+    it arrives instead of waiting for Tornado to buffer it.  The request
+    handler must be decorated with :func:`tornado.web.stream_request_body`
+    so that :meth:`data_received` is called for each chunk.  Each chunk
+    is passed to the incremental loader that was registered for the
+    content type so the memory required is bounded by the chunk size
+    instead of the body size.  Content types that do not have an
+    incremental loader are buffered and decoded when
+    :meth:`get_request_body` is called.
+
+    Decoding errors are deferred until :meth:`get_request_body` is
+    called so that they are reported as usual.  The exception is a
+    :mailheader:`Content-Length` that exceeds the ``max_body_size``
+    limit of the content type.  That is rejected with a *413* response
+    by :meth:`prepare` before the body is read, so handlers that
+    override :meth:`prepare` need to call the super class method.
+
+    :meth:`~HandlerMixin.get_request_records` decodes the buffered
+    chunks lazily when the content type has a record loader and no
+    incremental loader.  Otherwise, the body is decoded as a whole.
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(StreamingHandlerMixin, self).__init__(*args, **kwargs)
+        self._body_unpacker = None
+        self._body_error = None
+        self._body_size = 0
+        self._body_decode_time = 0.0
+
+    def prepare(self):
+        """
+        Start decoding the request body.
+
+        :raises: :class:`tornado.web.HTTPError` if the
+            :mailheader:`Content-Length` exceeds the size limit of the
+            content type (413).  Since this happens before Tornado reads
+            the body, the request is answered without reading it.
+
+        Nothing is started if the request handler is not decorated with
+        :func:`tornado.web.stream_request_body` since Tornado buffers
+        the body and :meth:`data_received` is never called.  The
+        buffered body is decoded by :meth:`get_request_body` instead.
+
+        """
+        super(StreamingHandlerMixin, self).prepare()
+        if not web._has_stream_request_body(type(self)):
+            return
+        content_length = self._content_length()
+        if not content_length:
+            return
+        try:
+            handler, charset = self._get_request_handler()
+        except web.HTTPError as error:
+            self._body_error = error
+            return
+        self._check_request_limit(handler,
+                                  handler.check_body_size(content_length))
+        self._body_unpacker = handler.start_unpacking(charset)
+
+    def data_received(self, chunk):
+        """Feed a chunk of the request body to the decoder."""
+        if self._body_error is not None:
+            return
+        metrics = self.content_registry.metrics
+        if metrics is not None:
+            start = timeit.default_timer()
+        try:
+            if self._body_unpacker is None:
+                handler, charset = self._get_request_handler()
+                self._body_unpacker = handler.start_unpacking(charset)
+            self._body_size += len(chunk)
+            handler = self._body_unpacker.handler
+            self._check_request_limit(
+                handler, handler.check_body_size(self._body_size))
+            self._body_unpacker.feed(chunk)
+            if metrics is not None:
+                self._body_decode_time += timeit.default_timer() - start
+        except web.HTTPError as error:
+            self._body_error = error
+        except ValueError as error:
+            self._body_error = _decode_failure(error)
+
+    def get_request_body(self):
+        """
+        Finishes decoding the request body and returns it.
+
+        :return: the decoded request body as a :class:`dict` instance.
+        :raises: :class:`tornado.web.HTTPError` if the body cannot be
+            decoded (415) or if decoding fails (400)
+
+        """
+        if self._request_body is None:
+            if self._body_error is not None:
+                raise self._body_error
+            if self._body_unpacker is None:
+                return super(StreamingHandlerMixin, self).get_request_body()
+            start = timeit.default_timer()
+            handler = self._body_unpacker.handler
+            body_type = None
+            if self._body_unpacker._loader is None:
+                body_type = self._get_typed_body_type(handler)
+            try:
+                body = self._body_unpacker.close(body_type)
+            except ValueError as error:
+                raise _decode_failure(error)
+            self._request_body = self._finish_request_body(
+                handler, body, body_type, self._body_size,
+                self._body_decode_time + timeit.default_timer() - start)
+        return self._request_body
+
+    def get_request_records(self):
+        """Decodes the request body as a sequence of records."""
+        if self._body_error is not None:
+            raise self._body_error
+        unpacker = self._body_unpacker
+        if unpacker is not None and unpacker._loader is not None:
+            # the incremental loader has already consumed the body
+            records = self._iterate_request_body()
+        else:
+            records = super(StreamingHandlerMixin, self).get_request_records()
+        for record in records:
+            yield record
+
+    def _content_length(self):
+        try:
+            return int(self.request.headers.get('Content-Length', 0))
+        except ValueError:
+            return 0
+
+    def _get_request_size(self):
+        if self._body_unpacker is None:
+            return super(StreamingHandlerMixin, self)._get_request_size()
+        return self._body_size
+
+    def _get_request_chunks(self):
+        if self._body_unpacker is None:
+            return super(StreamingHandlerMixin, self)._get_request_chunks()
+        return iter(self._body_unpacker._chunks)
@@ -10,13 +10,24 @@ Classes for testing applications that make asynchronous HTTP requests.
   from the application using ``Request`` instances.
 - ``Response``: used to configure what a ``Service`` instance will
   respond with
+- ``ProcessServiceLayer``: a ``ServiceLayer`` that runs its services
+  in child processes
+- ``RemoteService``: represents a service that is running in a
+  ``ProcessServiceLayer`` child process
 
 """
 import collections
+import functools
 import logging
+import multiprocessing
+import numbers
+import random
+import re
 import socket
+import struct
 
-from tornado import gen, httpserver, httputil, web
+from tornado import (escape, gen, httpserver, httputil, ioloop, iostream,
+                     web)
 
 from glinda import httpcompat
 
@@ -34,7 +45,9 @@ class ServiceLayer(object):
     is represented by a named :class:`Service` instance.  The
     :class:`Service` instance maintains the list of programmed responses.
     The :class:`ServiceLayer` exists to make sure that the requests get to
-    the appropriate handler.
+    the appropriate handler.  Each service is served by its own
+    :class:`~tornado.httpserver.HTTPServer` and application so the
+    same path can be configured differently on different services.
 
     Each managed service is exposed as named :class:`.Service` instance
     that is owned by the :class:`ServiceLayer` instance.  They are created
@@ -72,8 +85,7 @@ class ServiceLayer(object):
     def __init__(self):
         """Initialize the service layer."""
         super(ServiceLayer, self).__init__()
-        self._application = _Application()
-        self._server = httpserver.HTTPServer(self._application)
+        self._servers = {}
         self._services = {}
 
     def get_service(self, service):
@@ -92,14 +104,164 @@ class ServiceLayer(object):
         try:
             service_instance = self._services[service]
         except KeyError:
-            service_instance = Service(service, self._application.add_resource)
-            self._server.add_socket(service_instance.acceptor)
+            application = _Application()
+            service_instance = Service(service, application.add_resource)
+            server = httpserver.HTTPServer(application)
+            server.add_socket(service_instance.acceptor)
+            self._servers[service] = server
             self._services[service] = service_instance
         return service_instance
 
     __getitem__ = get_service
 
 
+class ProcessServiceLayer(object):
+    """
+    Runs HTTP services in child processes.
+
+    :param int processes: number of child processes to start
+
+    This is a drop-in replacement for :class:`ServiceLayer` that is
+    useful when the services are used for load testing.  The services
+    are run by :class:`ServiceLayer` instances on the IOLoops of child
+    processes so that they do not compete with the application under
+    test for the same CPU.  Services are assigned to processes in
+    round-robin order as they are created and each child process
+    runs all of the services assigned to it.
+
+    :meth:`.get_service` returns :class:`RemoteService` instances
+    that implement the same interface as :class:`Service` by sending
+    commands to the owning child process over a pipe.  The commands
+    are synchronous so the configuration is complete when the method
+    returns.
+
+    Call :meth:`.close` when you are finished with the instance to
+    stop the child processes::
+
+        def setUp(self):
+            super(MyTests, self).setUp()
+            self.service_layer = ProcessServiceLayer(processes=2)
+            self.addCleanup(self.service_layer.close)
+
+    The child processes are started with the *spawn* method when it
+    is available so that they do not inherit the IOLoop of the test.
+    This means that a script that creates a :class:`ProcessServiceLayer`
+    needs the usual ``if __name__ == '__main__'`` guard described in
+    the :mod:`multiprocessing` documentation.
+
+    """
+
+    def __init__(self, processes=1):
+        super(ProcessServiceLayer, self).__init__()
+        if processes < 1:
+            raise ValueError('processes must be positive')
+        self._children = []
+        self._services = {}
+        for _ in range(processes):
+            connection, child_connection = _MULTIPROCESSING.Pipe()
+            process = _MULTIPROCESSING.Process(
+                target=_run_services, args=(child_connection,))
+            process.daemon = True
+            process.start()
+            child_connection.close()
+            self._children.append((process, connection))
+
+    def get_service(self, service):
+        """
+        Retrieve a named service, creating it if necessary.
+
+        :param str service: name to assign to the service
+        :return: a :class:`RemoteService` instance
+
+        """
+        try:
+            service_instance = self._services[service]
+        except KeyError:
+            _, connection = self._children[
+                len(self._services) % len(self._children)]
+            call = functools.partial(_call_child, connection, service)
+            service_instance = RemoteService(service, call)
+            self._services[service] = service_instance
+        return service_instance
+
+    __getitem__ = get_service
+
+    def close(self):
+        """Stop the child processes."""
+        for process, connection in self._children:
+            try:
+                _call_child(connection, None, 'stop')
+            except (EOFError, IOError):
+                pass
+            connection.close()
+            process.join()
+        self._children = []
+
+
+class RemoteService(object):
+    """
+    Represents a :class:`Service` running in a child process.
+
+    :param str name: the name of the service
+    :param callable call: function that runs a :class:`Service`
+        method in the child process and returns the result
+
+    Instances of this class are created by
+    :meth:`ProcessServiceLayer.get_service`.  The methods match the
+    methods of :class:`Service` and exceptions raised in the child
+    process are re-raised from them.  Requests and responses are
+    pickled to cross the process boundary.
+
+    """
+
+    def __init__(self, name, call):
+        super(RemoteService, self).__init__()
+        self.name = name
+        self._call = call
+        self.host = call('get_service')
+
+    def add_endpoint(self, *path):
+        """Add an endpoint without configuring a response."""
+        self._call('add_endpoint', *path)
+
+    def add_response(self, request, response, times=1):
+        """Configure the service to respond to a specific request."""
+        self._call('add_response', request, response, times=times)
+
+    def add_responses(self, request, responses):
+        """
+        Configure the service to respond to a sequence of requests.
+
+        This sends all of the responses to the child process in a
+        single command.
+
+        """
+        self._call('add_responses', request, list(responses))
+
+    def set_network_conditions(self, delay=None, jitter=None,
+                               bytes_per_second=None, failure=None):
+        """Simulate network conditions for every response."""
+        self._call('set_network_conditions', delay=delay, jitter=jitter,
+                   bytes_per_second=bytes_per_second, failure=failure)
+
+    def url_for(self, *path, **query):
+        """Retrieve a URL that targets the service."""
+        return _service_url(self.host, path, query)
+
+    def get_requests_for(self, *path):
+        """Retrieve the requests made for `path`."""
+        for request in self._call('get_requests_for', *path):
+            yield request
+
+    def get_request(self, *path):
+        """Convenience method to fetch a single request."""
+        return next(self.get_requests_for(*path))
+
+    def assert_request(self, method, *path, **query):
+        """Assert that a specific request was made to the service."""
+        self._call('assert_request', method, *path, **query)
+
+
 class Request(object):
     """
     Matches a request from a client.
@@ -108,14 +270,18 @@ class Request(object):
     :param path: optional resource path to match
 
     Instances of this class are used by :class:`.Service` instances to
-    identify patterns that a client will request.
+    identify patterns that a client will request.  A path segment of
+    the form ``{name}`` is a template segment that matches any single
+    segment of the requested path so ``Request('GET', '/users/{id}')``
+    matches both ``/users/1`` and ``/users/2``.  Literal resources are
+    preferred over templates when both match a request.
 
     """
 
     def __init__(self, method, *path):
         super(Request, self).__init__()
         self.method = method
-        self.resource = _quote_path(*path)
+        self.resource = _quote_resource(*path)
         self.body = None
         self.headers = httputil.HTTPHeaders()
         self.query = {}
@@ -127,17 +293,48 @@ class Response(object):
 
     :param int status: HTTP status code to return
     :param str reason: optional phrase to return on the status line
-    :param bytes body: optional payload to return
+    :param body: optional payload to return.  This is anything that
+        :meth:`tornado.web.RequestHandler.write` accepts.
     :param dict headers: optional response headers
+    :param float delay: optional number of seconds to wait before
+        responding
+    :param jitter: optional random delay that is added to `delay`.
+        This is either a number of seconds that the additional delay
+        is uniformly distributed over or a callable that returns the
+        number of seconds such as
+        ``functools.partial(random.expovariate, 10)``.
+    :param int bytes_per_second: optional rate to stream the body at
+    :param str failure: optional failure to simulate instead of
+        responding.  :data:`RESET` resets the connection and
+        :data:`TIMEOUT` holds the connection open without responding
+        until the client closes it.
+
+    The `delay`, `jitter`, `bytes_per_second`, and `failure` parameters
+    override the values set with :meth:`Service.set_network_conditions`
+    for this response.  The delay and failures are simulated on the
+    IOLoop so they never block other requests.
 
     """
 
-    def __init__(self, status, reason=None, body=None, headers=None):
+    RESET = 'reset'
+    """Reset the connection instead of responding."""
+
+    TIMEOUT = 'timeout'
+    """Hold the connection open without responding."""
+
+    def __init__(self, status, reason=None, body=None, headers=None,
+                 delay=None, jitter=None, bytes_per_second=None,
+                 failure=None):
         super(Response, self).__init__()
         self.status = status
         self.reason = reason or 'Unspecified'
         self.body = body
         self.headers = (headers or {}).copy()
+        self.delay = delay
+        self.jitter = jitter
+        self.bytes_per_second = bytes_per_second
+        self.failure = failure
+        _check_network_conditions(bytes_per_second, failure)
 
 
 class Service(object):
@@ -191,8 +388,10 @@ class Service(object):
         self.acceptor.listen(10)
         self.host = '%s:%d' % self.acceptor.getsockname()
         self._requests = collections.defaultdict(list)
-        self._responses = collections.defaultdict(list)
+        self._responses = collections.defaultdict(collections.deque)
         self._endpoints = set()
+        self._conditions = {'delay': None, 'jitter': None,
+                            'bytes_per_second': None, 'failure': None}
 
         self.logger.info('listening on %s', self.host)
 
@@ -200,14 +399,15 @@ class Service(object):
         """
         Add an endpoint without configuring a response.
 
-        :param path: resource path
+        :param path: resource path.  This may include ``{name}``
+            template segments as described in :class:`.Request`.
 
         You only need to call this method if you want to create a resource
         without configuring a response.  Otherwise, you should call
         :meth:`.add_response` which will create the resource if necessary.
 
         """
-        self._register_endpoint(_quote_path(*path))
+        self._register_endpoint(_quote_resource(*path))
 
     def _register_endpoint(self, path):
         """
@@ -220,17 +420,82 @@ class Service(object):
             self.add_resource_callback(self, path)
             self._endpoints.add(path)
 
-    def add_response(self, request, response):
+    def add_response(self, request, response, times=1):
         """
         Configure the service to respond to a specific request.
 
         :param .Request request: request to match against
         :param .Response response: response to return when the
             handler receives `request`
+        :param int times: number of requests to return `response`
+            for.  If this is :data:`None`, then `response` is returned
+            for every matching request from now on and responses that
+            are added afterwards are never reached.
+
+        """
+        if times is not None and times < 1:
+            raise ValueError('times must be positive')
+        self._register_endpoint(request.resource)
+        self._responses[request.method, request.resource].append(
+            [response, times])
+
+    def add_responses(self, request, responses):
+        """
+        Configure the service to respond to a sequence of requests.
+
+        :param .Request request: request to match against
+        :param responses: iterable of :class:`.Response` instances to
+            return in order when the handler receives `request`
+
+        This is equivalent to calling :meth:`.add_response` for each
+        response but is cheaper when scripting thousands of responses.
 
         """
         self._register_endpoint(request.resource)
-        self._responses[request.method, request.resource].append(response)
+        self._responses[request.method, request.resource].extend(
+            [response, 1] for response in responses)
+
+    def set_network_conditions(self, delay=None, jitter=None,
+                               bytes_per_second=None, failure=None):
+        """
+        Simulate network conditions for every response.
+
+        :param float delay: number of seconds to wait before responding
+        :param jitter: random delay that is added to `delay`
+        :param int bytes_per_second: rate to stream response bodies at
+        :param str failure: failure to simulate instead of responding
+
+        The parameters are described in :class:`.Response`.  Values
+        that are set on individual responses take precedence over the
+        values set here.  Call this method without parameters to
+        remove the conditions.
+
+        """
+        _check_network_conditions(bytes_per_second, failure)
+        self._conditions = {'delay': delay, 'jitter': jitter,
+                            'bytes_per_second': bytes_per_second,
+                            'failure': failure}
+
+    def get_network_conditions(self, response):
+        """
+        Retrieve the network conditions to simulate for a response.
+
+        :param .Response response: the response that is being sent
+        :return: a tuple of the number of seconds to delay, the rate
+            to stream the body at, and the failure to simulate
+
+        """
+        conditions = {}
+        for name, default in self._conditions.items():
+            value = getattr(response, name, None)
+            conditions[name] = default if value is None else value
+
+        delay, jitter = conditions['delay'] or 0, conditions['jitter']
+        if isinstance(jitter, numbers.Number):
+            delay += random.uniform(0, jitter)
+        elif jitter is not None:
+            delay += jitter()
+        return delay, conditions['bytes_per_second'], conditions['failure']
 
     def record_request(self, request):
         """
@@ -261,35 +526,41 @@ class Service(object):
             this service and includes the specified `path` and `query`
 
         """
-        resource = _quote_path(*path)
-        query_str = httpcompat.urlencode(sorted(query.items()))
-        return httpcompat.urlunsplit(('http', self.host, resource,
-                                      query_str, None))
+        return _service_url(self.host, path, query)
 
-    def get_next_response(self, tornado_request):
+    def get_next_response(self, tornado_request, resource=None):
         """
         Retrieve the next response for a request.
 
         :param tornado.httputil.HTTPRequest tornado_request:
+        :param str resource: the registered resource that matched
+            `tornado_request`.  This defaults to the request path and
+            is the template when a template resource matched.
 
         Responses are matched to the request using the request
-        method and URI as a key.  If a response was registered
-        for the method and URI, then it is popped and returned.
-        If there is no response configured for `tornado_request`,
-        then an exception is raised.
+        method and resource as a key.  If a response was registered
+        for the method and URI, then it is returned and removed
+        once it has been returned as many times as it was added
+        for.  If there is no response configured for
+        `tornado_request`, then an exception is raised.
 
         :raises tornado.web.HTTPError:
             with a status of 456 if the service doesn't have a
             response configured for `tornado_request`
 
         """
-        key = tornado_request.method, tornado_request.path
+        key = tornado_request.method, resource or tornado_request.path
         try:
-            response = self._responses[key].pop(0)
+            responses = self._responses[key]
+            entry = responses[0]
+            if entry[1] is not None:
+                entry[1] -= 1
+                if not entry[1]:
+                    responses.popleft()
             self.logger.debug('returning response for %s %s: %r',
                               tornado_request.method, tornado_request.path,
-                              response)
-            return response
+                              entry[0])
+            return entry[0]
         except IndexError:
             self.logger.error(
                 'failed to find response for %s %s: response keys=%r',
@@ -350,18 +621,35 @@ class _Application(web.Application):
     """
     Tornado application that implements the service abstraction.
 
-    This application glues the :class:`Service` instances to the
-    ioloop.  Most of the logic is in the :class:`Service` instances
-    and the :class:`ServiceLayer` instance.  Instead of calling the
+    This application glues a :class:`Service` instance to the
+    ioloop.  Each service has its own application so resources
+    are never shared between services.  Most of the logic is in
+    the :class:`Service` instances and the :class:`ServiceLayer`
+    instance.  Instead of calling the
     :meth:`add_handler` method, call :meth:`add_resource` to install
     a instance of :class:`_ServiceHandler` that will interact with
     a specific service.
 
+    Service resources are kept in a :class:`_ResourceTable` instead
+    of the Tornado routing rules so that finding the handler does
+    not depend on the number of resources.  Requests that do not
+    match a resource fall through to the standard rules.
+
     """
 
     def __init__(self):
         # overridden to install a default handler
         super(_Application, self).__init__([web.url('/', _ErrorHandler)])
+        self.resources = _ResourceTable()
+
+    def find_handler(self, request, **kwargs):
+        match = self.resources.find(request.path)
+        if match is None:
+            return super(_Application, self).find_handler(request, **kwargs)
+        service, resource = match
+        return self.get_handler_delegate(
+            request, _ServiceHandler,
+            target_kwargs={'service': service, 'resource': resource})
 
     def add_resource(self, service, resource):
         """
@@ -373,10 +661,82 @@ class _Application(web.Application):
         :param str resource: path to mount the new resource at
 
         """
-        handler = web.url(resource, _ServiceHandler,
-                          kwargs={'service': service})
-        # leave the error handler at the end
-        self.default_router.rules.insert(-1, handler)
+        self.resources.add(resource, service)
+
+
+class _ResourceTable(object):
+    """
+    Maps request paths to service resources.
+
+    Literal resources are stored in a :class:`dict` keyed by path.
+    Resources that contain ``{name}`` template segments are stored
+    in a trie of path segments where each node is a :class:`dict`
+    that maps literal segments to child nodes.  The :data:`None` key
+    holds the child node for template segments and the
+    :data:`_RESOURCE` key holds the ``(service, resource)`` pair
+    for a resource that ends at the node.
+
+    """
+
+    _RESOURCE = ()
+
+    def __init__(self):
+        super(_ResourceTable, self).__init__()
+        self._literals = {}
+        self._templates = {}
+
+    def add(self, resource, service):
+        """
+        Add a resource to the table.
+
+        :param str resource: quoted resource path that may include
+            template segments
+        :param Service service: service that owns `resource`
+
+        """
+        segments = resource.split('/')
+        if not any(_TEMPLATE_SEGMENT.match(s) for s in segments):
+            self._literals[resource] = service, resource
+            return
+
+        node = self._templates
+        for segment in segments:
+            key = None if _TEMPLATE_SEGMENT.match(segment) else segment
+            node = node.setdefault(key, {})
+        node[self._RESOURCE] = service, resource
+
+    def find(self, path):
+        """
+        Find the resource for a request path.
+
+        :param str path: the path from the request line
+        :return: a ``(service, resource)`` tuple or :data:`None`
+
+        Literal segments are preferred over template segments at
+        each level of the trie.  Template segments do not match empty
+        segments.
+
+        """
+        try:
+            return self._literals[path]
+        except KeyError:
+            pass
+        if not self._templates:
+            return None
+
+        segments = path.split('/')
+        pending = [(self._templates, 0)]
+        while pending:
+            node, depth = pending.pop()
+            if depth == len(segments):
+                if self._RESOURCE in node:
+                    return node[self._RESOURCE]
+                continue
+            if None in node and segments[depth]:
+                pending.append((node[None], depth + 1))
+            if segments[depth] in node:
+                pending.append((node[segments[depth]], depth + 1))
+        return None
 
 
 class _ErrorHandler(web.RequestHandler):
@@ -390,12 +750,17 @@ class _ServiceHandler(web.RequestHandler):
 
     Each endpoint is handled by an instance of this class.  It
     does little more than proxy requests between the ioloop and
-    the :class:`Service` instances.
+    the :class:`Service` instances and simulate the network
+    conditions that are configured for the response.
 
     """
 
+    write_interval = 0.1
+    """Seconds between writes when the body is streamed at a rate."""
+
     def __init__(self, *args, **kwargs):
         self.service = kwargs.pop('service')
+        self.resource = kwargs.pop('resource', None)
         super(_ServiceHandler, self).__init__(*args, **kwargs)
 
     def prepare(self):
@@ -404,14 +769,66 @@ class _ServiceHandler(web.RequestHandler):
 
     @gen.coroutine
     def _do_request(self, *args, **kwargs):
-        response = self.service.get_next_response(self.request)
+        response = self.service.get_next_response(self.request,
+                                                  self.resource)
+        delay, bytes_per_second, failure = \
+            self.service.get_network_conditions(response)
+        if delay > 0:
+            yield gen.sleep(delay)
+
+        if failure == Response.RESET:
+            self._reset_connection()
+            return
+        if failure == Response.TIMEOUT:
+            yield self._stall_connection()
+            return
+
         self.set_status(response.status, response.reason)
         for name, value in response.headers.items():
             self.set_header(name, value)
-        if response.body:
+        if response.body and bytes_per_second:
+            yield self._write_throttled(response.body, bytes_per_second)
+        elif response.body:
             self.write(response.body)
         self.finish()
 
+    def _detach(self):
+        if hasattr(web.RequestHandler, 'detach'):
+            return self.detach()
+        # RequestHandler.detach was added in Tornado 5.1
+        self._finished = True
+        return self.request.connection.detach()
+
+    def _reset_connection(self):
+        stream = self._detach()
+        # a zero linger time makes close send a RST instead of a FIN
+        stream.socket.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                                 struct.pack('ii', 1, 0))
+        stream.close()
+
+    @gen.coroutine
+    def _stall_connection(self):
+        stream = self._detach()
+        try:
+            yield stream.read_until_close()
+        except iostream.StreamClosedError:
+            pass
+        stream.close()
+
+    @gen.coroutine
+    def _write_throttled(self, body, bytes_per_second):
+        if isinstance(body, dict):  # mimic RequestHandler.write
+            body = escape.json_encode(body)
+            self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        body = escape.utf8(body)
+        self.set_header('Content-Length', len(body))
+        chunk_size = max(1, int(bytes_per_second * self.write_interval))
+        for offset in range(0, len(body), chunk_size):
+            chunk = body[offset:offset + chunk_size]
+            self.write(chunk)
+            yield self.flush()
+            yield gen.sleep(float(len(chunk)) / bytes_per_second)
+
     connect = _do_request
     delete = _do_request
     get = _do_request
@@ -422,6 +839,103 @@ class _ServiceHandler(web.RequestHandler):
     trace = _do_request
 
 
+_TEMPLATE_SEGMENT = re.compile(r'^{[A-Za-z_][A-Za-z0-9_]*}$')
+
+
+try:
+    _MULTIPROCESSING = multiprocessing.get_context('spawn')
+except AttributeError:  # pragma: no cover -- python 2 only forks
+    _MULTIPROCESSING = multiprocessing
+
+_REMOTE_COMMANDS = frozenset(['add_endpoint', 'add_response',
+                              'add_responses', 'assert_request',
+                              'set_network_conditions'])
+
+
+def _check_network_conditions(bytes_per_second, failure):
+    if bytes_per_second is not None and bytes_per_second <= 0:
+        raise ValueError('bytes_per_second must be positive')
+    if failure not in (None, Response.RESET, Response.TIMEOUT):
+        raise ValueError('unknown failure {0!r}'.format(failure))
+
+
+def _call_child(connection, name, command, *args, **kwargs):
+    connection.send((command, name, args, kwargs))
+    status, result = connection.recv()
+    if status == 'error':
+        raise result
+    return result
+
+
+def _run_services(connection):
+    """
+    Run a service layer that is controlled by `connection`.
+
+    :param multiprocessing.connection.Connection connection:
+        the child end of the control pipe
+
+    This is the entry point of :class:`ProcessServiceLayer` child
+    processes.  It runs a :class:`ServiceLayer` on a new IOLoop and
+    executes the commands that arrive over `connection` on the IOLoop
+    until it receives a ``stop`` command or the pipe is closed.
+
+    """
+    io_loop = ioloop.IOLoop()
+    service_layer = ServiceLayer()  # services are created in the loop
+
+    def on_command(fd, events):
+        try:
+            command, name, args, kwargs = connection.recv()
+        except EOFError:  # parent went away
+            io_loop.remove_handler(fd)
+            io_loop.stop()
+            return
+        if command == 'stop':
+            io_loop.remove_handler(fd)
+            io_loop.stop()
+            connection.send(('ok', None))
+            return
+
+        try:
+            service = service_layer.get_service(name)
+            if command == 'get_service':
+                result = service.host
+            elif command == 'get_requests_for':
+                result = list(service.get_requests_for(*args))
+            elif command in _REMOTE_COMMANDS:
+                result = getattr(service, command)(*args, **kwargs)
+            else:
+                raise ValueError('unknown command {0}'.format(command))
+        except Exception as error:
+            try:
+                connection.send(('error', error))
+            except Exception:  # exceptions do not always pickle
+                connection.send(('error', RuntimeError(repr(error))))
+        else:
+            connection.send(('ok', result))
+
+    io_loop.add_handler(connection.fileno(), on_command, io_loop.READ)
+    try:
+        io_loop.start()
+    finally:
+        io_loop.close(all_fds=True)
+        connection.close()
+
+
+def _service_url(host, path, query):
+    resource = _quote_path(*path)
+    query_str = httpcompat.urlencode(sorted(query.items()))
+    return httpcompat.urlunsplit(('http', host, resource, query_str, None))
+
+
 def _quote_path(*path):
     path_str = '/'.join(httpcompat.quote(segment) for segment in path)
     return path_str if path_str.startswith('/') else '/' + path_str
+
+
+def _quote_resource(*path):
+    segments = '/'.join(path).split('/')
+    path_str = '/'.join(segment if _TEMPLATE_SEGMENT.match(segment)
+                        else httpcompat.quote(segment)
+                        for segment in segments)
+    return path_str if path_str.startswith('/') else '/' + path_str
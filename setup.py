@@ -41,8 +41,8 @@ setuptools.setup(
     url='http://github.com/dave-shawley/glinda',
     description='Helping your through the Tornado.',
     long_description=long_description,
-    packages=setuptools.find_packages(exclude=['examples', 'tests',
-                                               'tests.*']),
+    packages=setuptools.find_packages(exclude=['benchmarks', 'examples',
+                                               'tests', 'tests.*']),
     zip_safe=True,
     platforms='any',
     install_requires=install_requirements,
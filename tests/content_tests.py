@@ -1,7 +1,12 @@
+import functools
 import json
+import logging
+import pickle
 import re
+import unittest
+import zlib
 
-from tornado import testing, web
+from tornado import concurrent, gen, testing, web
 import msgpack
 
 from examples import contentneg
@@ -101,6 +106,19 @@ class ContentSelectionTests(testing.AsyncHTTPTestCase):
         body = msgpack.unpackb(response.body)
         self.assertEqual(body[b'headers'][b'Accept'], b'application/msgpack')
 
+    def test_that_native_string_loader_is_used_directly(self):
+        content.register_binary_type(
+            'application/msgpack', msgpack.packb,
+            functools.partial(msgpack.unpackb, raw=False),
+            accepts_buffer=True, native_strings=True)
+        body = {'some': 'simple', 'and complex': ['body', 'elements']}
+        response = self.fetch('/', method='POST', body=msgpack.packb(body),
+                              headers={
+                                  'Content-Type': 'application/msgpack',
+                                  'Accept': 'application/json'})
+        self.assertEqual(json.loads(response.body.decode('utf-8'))['body'],
+                         body)
+
     def test_that_header_driven_translation_works(self):
         body = {'some': 'simple', 'and complex': ['body', 'elements']}
         response = self.fetch('/', method='POST', body=msgpack.packb(body),
@@ -185,3 +203,1386 @@ class TextEncodingTests(testing.AsyncHTTPTestCase):
     def test_that_unknown_encoding_raises_406(self):
         response = self.fetch('/', headers={'Accept-Charset': 'foo'})
         self.assertEqual(response.code, 406)
+
+    def test_that_refused_default_encoding_raises_406(self):
+        response = self.fetch('/', headers={'Accept-Charset': 'utf-8;q=0'})
+        self.assertEqual(response.code, 406)
+        response = self.fetch('/', headers={'Accept-Charset': '*;q=0'})
+        self.assertEqual(response.code, 406)
+
+    def test_that_next_acceptable_charset_is_used(self):
+        content.register_text_type(
+            'application/json', 'utf-8',
+            functools.partial(json.dumps, ensure_ascii=False), json.loads)
+        body = json.dumps({'text': KOREAN_TEXT}).encode('utf-8')
+        response = self.fetch('/', body=body, method='POST', headers={
+            'Content-Type': 'application/json; charset=utf-8',
+            'Accept': 'application/json',
+            'Accept-Charset': 'latin1, foo;q=0.9, euc_kr;q=0.5, utf-8;q=0',
+        })
+        self.assertEqual(response.headers['Content-Type'],
+                         'application/json; charset=euc_kr')
+        self.assertEqual(json.loads(response.body.decode('euc_kr'))['body'],
+                         {'text': KOREAN_TEXT})
+
+
+class NegotiationCacheTests(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        return web.Application([web.url('/', contentneg.HttpbinHandler)])
+
+    def setUp(self):
+        super(NegotiationCacheTests, self).setUp()
+        content.register_text_type('application/json', 'utf-8',
+                                   json.dumps, json.loads)
+
+    def tearDown(self):
+        super(NegotiationCacheTests, self).tearDown()
+        content.clear_handlers()
+
+    def test_that_repeated_accept_header_hits_cache(self):
+        self.fetch('/', headers={'Accept': 'application/json'})
+        self.fetch('/', headers={'Accept': 'application/json'})
+        info = content.negotiation_cache_info()
+        self.assertEqual(info.misses, 1)
+        self.assertEqual(info.hits, 1)
+        self.assertEqual(info.currsize, 1)
+
+    def test_that_registration_invalidates_cache(self):
+        response = self.fetch('/', headers={'Accept': 'application/msgpack'})
+        self.assertEqual(response.code, 406)
+
+        content.register_binary_type('application/msgpack', msgpack.packb,
+                                     msgpack.unpackb)
+        self.assertEqual(content.negotiation_cache_info().currsize, 0)
+        response = self.fetch('/', headers={'Accept': 'application/msgpack'})
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers['Content-Type'],
+                         'application/msgpack')
+
+    def test_that_clear_handlers_invalidates_cache(self):
+        self.fetch('/', headers={'Accept': 'application/json'})
+        content.clear_handlers()
+        self.assertEqual(content.negotiation_cache_info().currsize, 0)
+        response = self.fetch('/', headers={'Accept': 'application/json'})
+        self.assertEqual(response.code, 406)
+
+
+class RequestContentTypeLookupTests(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        return web.Application([web.url('/', contentneg.HttpbinHandler)])
+
+    def setUp(self):
+        super(RequestContentTypeLookupTests, self).setUp()
+        content.register_text_type('application/json', 'utf-8',
+                                   json.dumps, json.loads)
+
+    def tearDown(self):
+        super(RequestContentTypeLookupTests, self).tearDown()
+        content.clear_handlers()
+
+    def test_that_media_type_lookup_is_case_insensitive(self):
+        response = self.fetch('/', method='POST', body=b'{"one":1}',
+                              headers={'Content-Type': ' Application/JSON'})
+        self.assertEqual(response.code, 200)
+        body = json.loads(response.body.decode('utf-8'))
+        self.assertEqual(body['body'], {'one': 1})
+
+    def test_that_parameters_do_not_prevent_lookup(self):
+        response = self.fetch('/', method='POST',
+                              body=u'{"v":"\u00FF"}'.encode('latin1'),
+                              headers={'Content-Type': 'application/json; '
+                                                       'charset=latin1'})
+        self.assertEqual(response.code, 200)
+        body = json.loads(response.body.decode('utf-8'))
+        self.assertEqual(body['body'], {'v': u'\u00FF'})
+
+
+class ContentHandlerTests(unittest.TestCase):
+
+    def setUp(self):
+        super(ContentHandlerTests, self).setUp()
+        self.handler = content._ContentHandler('application/json')
+
+    def test_that_content_type_header_includes_charset(self):
+        self.assertEqual(self.handler.get_content_type_header('utf-8'),
+                         'application/json; charset=utf-8')
+        self.assertEqual(self.handler.get_content_type_header(None),
+                         'application/json')
+
+    def test_that_text_is_serialized_once_when_charset_fails(self):
+        calls = []
+        self.handler.dict_to_string = lambda obj: calls.append(obj) or (
+            u'\uc138\uacc4')
+        self.assertEqual(self.handler.pack_bytes({}, 'latin1', ('euc_kr',)),
+                         ('euc_kr', u'\uc138\uacc4'.encode('euc_kr')))
+        self.assertEqual(self.handler.pack_bytes({}, 'latin1'),
+                         ('utf-8', u'\uc138\uacc4'.encode('utf-8')))
+        self.assertEqual(self.handler.pack_bytes({}, 'foo', ('ascii', None)),
+                         ('utf-8', u'\uc138\uacc4'.encode('utf-8')))
+        self.assertEqual(len(calls), 3)
+
+    def test_that_stateful_stream_encoding_is_finalized(self):
+        self.handler.dict_to_string = json.dumps
+        self.handler.iterable_to_strings = lambda iterable: iter(iterable)
+        encoding, chunks = self.handler.pack_stream(
+            [u'abc', u'\u65e5\u672c'], 'utf-16')
+        self.assertEqual(encoding, 'utf-16')
+        self.assertEqual(b''.join(chunks),
+                         u'abc\u65e5\u672c'.encode('utf-16'))
+
+    def test_that_text_is_streamed_only_with_utf(self):
+        self.handler.dict_to_string = json.dumps
+        self.handler.iterable_to_strings = lambda iterable: iter(iterable)
+        encoding, chunks = self.handler.pack_stream(
+            [u'abc'], 'latin1', ('utf-8', None))
+        self.assertEqual(encoding, 'utf-8')
+        self.assertEqual(b''.join(chunks), b'abc')
+        encoding, chunks = self.handler.pack_stream([u'abc'], 'latin1')
+        self.assertEqual(encoding, 'latin1')
+        self.assertEqual(b''.join(chunks), b'["abc"]')
+
+    def test_that_unknown_charsets_are_skipped(self):
+        self.handler.dict_to_string = json.dumps
+        self.assertEqual(self.handler.pack_bytes({}, 'foo', ('latin1',)),
+                         ('latin1', b'{}'))
+        with self.assertRaises(web.HTTPError) as context:
+            self.handler.pack_bytes({}, 'foo', ('bar',))
+        self.assertEqual(context.exception.status_code, 406)
+
+    def test_that_charsets_are_ordered_by_quality(self):
+        self.assertEqual(
+            content._select_charsets(
+                'latin1;q=0.5, utf-8;q=0.9, *;q=0.1, ascii;q=0, koi8-r'),
+            (('koi8-r', 'utf-8', 'latin1', None), frozenset(['ascii'])))
+        self.assertEqual(content._select_charsets('UTF8;q=0, foo;q=0'),
+                         ((None,), frozenset(['utf-8'])))
+        self.assertEqual(content._select_charsets('*;q=0'),
+                         ((None,), frozenset(['*'])))
+
+    def test_that_refused_charsets_are_not_used(self):
+        self.handler.dict_to_string = lambda obj: u'caf\xe9'
+        self.assertEqual(
+            self.handler.pack_bytes({}, 'latin1', (), frozenset(['*'])),
+            ('latin1', u'caf\xe9'.encode('latin1')))
+        for encoding, refused in ((None, 'utf-8'), ('ascii', 'utf-8'),
+                                  ('ascii', '*'), (None, '*')):
+            with self.assertRaises(web.HTTPError) as context:
+                self.handler.pack_bytes({}, encoding, (),
+                                        frozenset([refused]))
+            self.assertEqual(context.exception.status_code, 406)
+
+    def test_that_structure_is_checked_only_with_limits(self):
+        self.assertIsNone(self.handler.check_structure([[[[]]]]))
+        self.handler.max_depth = 2
+        self.assertIsNone(self.handler.check_structure({'a': [1, 2]}))
+        self.assertIsNone(self.handler.check_structure('scalar'))
+        self.assertEqual(self.handler.check_structure({'a': [[1]]}),
+                         'max_depth')
+        self.handler.max_depth, self.handler.max_elements = None, 0
+        self.assertIsNone(self.handler.check_structure({}))
+        self.assertEqual(self.handler.check_structure([None]),
+                         'max_elements')
+
+    def test_that_content_type_header_is_reused(self):
+        first = self.handler.get_content_type_header('utf-8')
+        self.assertIs(self.handler.get_content_type_header('utf-8'), first)
+
+    def test_that_buffer_is_passed_to_loader_when_accepted(self):
+        received = []
+        self.handler.bytes_to_dict = lambda buf: received.append(buf) or {}
+        self.handler.unpack_bytes(b'body')
+        self.assertIsInstance(received[-1], bytes)
+
+        self.handler.accepts_buffer = True
+        self.handler.unpack_bytes(b'body')
+        self.assertIsInstance(received[-1], memoryview)
+
+    def test_that_byte_strings_are_converted_by_default(self):
+        self.handler.bytes_to_dict = lambda buf: {b'key': [b'value']}
+        self.assertEqual(self.handler.unpack_bytes(b''),
+                         {u'key': [u'value']})
+
+    def test_that_native_strings_skips_conversion(self):
+        decoded = {b'key': [b'value']}
+        self.handler.bytes_to_dict = lambda buf: decoded
+        self.handler.native_strings = True
+        self.assertIs(self.handler.unpack_bytes(b''), decoded)
+
+    def test_that_rendered_headers_are_bounded(self):
+        for index in range(content._MAX_RENDERED_HEADERS * 2):
+            self.handler.get_content_type_header('charset-{0}'.format(index))
+        self.assertEqual(len(self.handler._content_type_headers),
+                         content._MAX_RENDERED_HEADERS)
+
+
+class RecordingJsonLoader(object):
+    """Incremental JSON loader that records the chunks it receives."""
+
+    chunks = []
+
+    def feed(self, data):
+        self.chunks.append(data)
+
+    def close(self):
+        return json.loads(''.join(self.chunks))
+
+
+class MsgpackLoader(object):
+    """Adapts :class:`msgpack.Unpacker` to the incremental interface."""
+
+    def __init__(self):
+        self.unpacker = msgpack.Unpacker()
+
+    def feed(self, data):
+        self.unpacker.feed(data)
+
+    def close(self):
+        return next(self.unpacker)
+
+
+@web.stream_request_body
+class StreamingHandler(content.StreamingHandlerMixin, web.RequestHandler):
+
+    def post(self):
+        self.send_response(self.get_request_body())
+        self.finish()
+
+
+class UndecoratedStreamingHandler(content.StreamingHandlerMixin,
+                                  web.RequestHandler):
+
+    def post(self):
+        self.send_response(self.get_request_body())
+        self.finish()
+
+
+@web.stream_request_body
+class CountingStreamingHandler(StreamingHandler):
+    chunks = []
+
+    def data_received(self, chunk):
+        self.chunks.append(len(chunk))
+        super(CountingStreamingHandler, self).data_received(chunk)
+
+
+class StreamingRequestBodyTests(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        return web.Application([
+            web.url('/', StreamingHandler),
+            web.url('/undecorated', UndecoratedStreamingHandler)])
+
+    def get_httpserver_options(self):
+        return {'chunk_size': 8}
+
+    def setUp(self):
+        super(StreamingRequestBodyTests, self).setUp()
+        RecordingJsonLoader.chunks = []
+        content.register_text_type('application/json', 'utf-8',
+                                   json.dumps, json.loads,
+                                   incremental_loader=RecordingJsonLoader)
+        content.register_binary_type('application/msgpack', msgpack.packb,
+                                     msgpack.unpackb,
+                                     incremental_loader=MsgpackLoader)
+
+    def tearDown(self):
+        super(StreamingRequestBodyTests, self).tearDown()
+        content.clear_handlers()
+
+    def test_that_text_body_is_decoded_incrementally(self):
+        body = {'name': KOREAN_TEXT}
+        response = self.fetch('/', method='POST',
+                              body=json.dumps(body, ensure_ascii=False)
+                              .encode('utf-8'),
+                              headers={'Content-Type': 'application/json',
+                                       'Accept': 'application/json'})
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json.loads(response.body.decode('utf-8')), body)
+        self.assertGreater(len(RecordingJsonLoader.chunks), 1)
+
+    def test_that_binary_body_is_decoded_incrementally(self):
+        body = {'some': 'simple', 'and complex': ['body', 'elements']}
+        response = self.fetch('/', method='POST', body=msgpack.packb(body),
+                              headers={'Content-Type': 'application/msgpack',
+                                       'Accept': 'application/json'})
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json.loads(response.body.decode('utf-8')), body)
+
+    def test_that_types_without_incremental_loader_are_buffered(self):
+        content.register_text_type('application/json', 'utf-8',
+                                   json.dumps, json.loads)
+        response = self.fetch('/', method='POST', body=b'{"one":1}',
+                              headers={'Content-Type': 'application/json'})
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json.loads(response.body.decode('utf-8')),
+                         {'one': 1})
+
+    def test_that_decode_failure_results_in_client_error(self):
+        response = self.fetch('/', method='POST', body=b'not json',
+                              headers={'Content-Type': 'application/json'})
+        self.assertEqual(response.code, 400)
+
+    def test_that_unknown_content_type_results_in_unsupp_media_type(self):
+        response = self.fetch('/', method='POST', body=b'<body/>',
+                              headers={'Content-Type': 'application/xml'})
+        self.assertEqual(response.code, 415)
+
+    def test_that_undecorated_handler_decodes_buffered_body(self):
+        response = self.fetch('/undecorated', method='POST',
+                              body=b'{"one":1}',
+                              headers={'Content-Type': 'application/json'})
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json.loads(response.body.decode('utf-8')),
+                         {'one': 1})
+
+
+def json_array_dumper(iterable):
+    yield '['
+    separator = ''
+    for item in iterable:
+        yield separator + json.dumps(item)
+        separator = ','
+    yield ']'
+
+
+def msgpack_stream_dumper(iterable):
+    for item in iterable:
+        yield msgpack.packb(item)
+
+
+class StreamingResponseHandler(content.HandlerMixin, web.RequestHandler):
+
+    response_chunk_size = 64
+
+    @gen.coroutine
+    def get(self):
+        count = int(self.get_query_argument('count'))
+        label = self.get_query_argument('label', None)
+        yield self.send_response_stream(
+            {'index': index} if label is None else
+            {'index': index, 'label': label}
+            for index in range(count))
+        self.finish()
+
+
+class StreamingResponseTests(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        return web.Application([web.url('/', StreamingResponseHandler)])
+
+    def setUp(self):
+        super(StreamingResponseTests, self).setUp()
+        content.register_text_type('application/json', 'utf-8',
+                                   json.dumps, json.loads,
+                                   stream_dumper=json_array_dumper)
+        content.register_binary_type('application/msgpack', msgpack.packb,
+                                     msgpack.unpackb,
+                                     stream_dumper=msgpack_stream_dumper)
+
+    def tearDown(self):
+        super(StreamingResponseTests, self).tearDown()
+        content.clear_handlers()
+
+    def test_that_text_stream_is_chunked(self):
+        response = self.fetch('/?count=100',
+                              headers={'Accept': 'application/json'})
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers['Content-Type'],
+                         'application/json; charset=utf-8')
+        self.assertEqual(response.headers['Transfer-Encoding'], 'chunked')
+        self.assertEqual(json.loads(response.body.decode('utf-8')),
+                         [{'index': index} for index in range(100)])
+
+    def test_that_binary_stream_is_packed_per_item(self):
+        response = self.fetch('/?count=10',
+                              headers={'Accept': 'application/msgpack'})
+        self.assertEqual(response.headers['Content-Type'],
+                         'application/msgpack')
+        unpacker = msgpack.Unpacker()
+        unpacker.feed(response.body)
+        self.assertEqual(list(unpacker),
+                         [{b'index': index} for index in range(10)])
+
+    def test_that_empty_stream_is_encoded(self):
+        response = self.fetch('/?count=0',
+                              headers={'Accept': 'application/json'})
+        self.assertEqual(json.loads(response.body.decode('utf-8')), [])
+
+    def test_that_types_without_stream_dumper_are_encoded_as_list(self):
+        content.register_text_type('application/json', 'utf-8',
+                                   json.dumps, json.loads)
+        response = self.fetch('/?count=3',
+                              headers={'Accept': 'application/json'})
+        self.assertEqual(json.loads(response.body.decode('utf-8')),
+                         [{'index': index} for index in range(3)])
+
+    def test_that_no_acceptable_content_type_raises_406(self):
+        response = self.fetch('/?count=3',
+                              headers={'Accept': 'application/xml'})
+        self.assertEqual(response.code, 406)
+
+    def test_that_unrepresentable_text_is_not_streamed_as_latin1(self):
+        content.register_text_type(
+            'application/json', 'utf-8',
+            functools.partial(json.dumps, ensure_ascii=False), json.loads,
+            stream_dumper=lambda iterable: (
+                json.dumps(item, ensure_ascii=False) for item in iterable))
+        response = self.fetch(
+            '/?count=2&label=%E4%B8%96%E7%95%8C',
+            headers={'Accept': 'application/json',
+                     'Accept-Charset': 'iso-8859-1, utf-8;q=0.5'})
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers['Content-Type'],
+                         'application/json; charset=utf-8')
+        self.assertIn(u'\u4e16\u754c'.encode('utf-8'), response.body)
+
+    def test_that_latin1_stream_is_encoded_as_list(self):
+        response = self.fetch(
+            '/?count=3&label=caf%C3%A9',
+            headers={'Accept': 'application/json',
+                     'Accept-Charset': 'iso-8859-1'})
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers['Content-Type'],
+                         'application/json; charset=iso-8859-1')
+        self.assertEqual(json.loads(response.body.decode('iso-8859-1')),
+                         [{'index': index, 'label': u'caf\xe9'}
+                          for index in range(3)])
+
+
+class CompressingHandler(content.HandlerMixin, web.RequestHandler):
+
+    compress_responses = True
+    compression_threshold = 64
+
+    def get(self):
+        size = int(self.get_query_argument('size'))
+        self.send_response({'data': 'x' * size})
+        self.finish()
+
+
+class ExecutorCompressingHandler(CompressingHandler):
+
+    compression_executor = concurrent.dummy_executor
+
+    @gen.coroutine
+    def get(self):
+        size = int(self.get_query_argument('size'))
+        yield self.send_response({'data': 'x' * size})
+        self.finish()
+
+
+class ResponseCompressionTests(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        return web.Application([
+            web.url('/', CompressingHandler),
+            web.url('/executor', ExecutorCompressingHandler),
+        ])
+
+    def setUp(self):
+        super(ResponseCompressionTests, self).setUp()
+        content.register_text_type('application/json', 'utf-8',
+                                   json.dumps, json.loads)
+
+    def tearDown(self):
+        super(ResponseCompressionTests, self).tearDown()
+        content.clear_handlers()
+
+    def fetch_raw(self, path, accept_encoding):
+        return self.fetch(path, decompress_response=False,
+                          headers={'Accept-Encoding': accept_encoding})
+
+    def test_that_large_responses_are_gzipped(self):
+        response = self.fetch_raw('/?size=1000', 'gzip, deflate')
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.headers['Vary'], 'Accept-Encoding')
+        body = zlib.decompress(response.body, zlib.MAX_WBITS | 16)
+        self.assertEqual(json.loads(body.decode('utf-8')),
+                         {'data': 'x' * 1000})
+
+    def test_that_quality_values_select_coding(self):
+        response = self.fetch_raw('/?size=1000', 'gzip;q=0.5, deflate')
+        self.assertEqual(response.headers['Content-Encoding'], 'deflate')
+        self.assertEqual(json.loads(zlib.decompress(response.body)),
+                         {'data': 'x' * 1000})
+
+    def test_that_small_responses_are_not_compressed(self):
+        response = self.fetch_raw('/?size=10', 'gzip')
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(json.loads(response.body.decode('utf-8')),
+                         {'data': 'x' * 10})
+
+    def test_that_unsupported_codings_are_not_used(self):
+        response = self.fetch_raw('/?size=1000', 'compress, identity;q=0.5')
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_that_compression_can_use_executor(self):
+        response = self.fetch_raw('/executor?size=1000', 'gzip')
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        body = zlib.decompress(response.body, zlib.MAX_WBITS | 16)
+        self.assertEqual(json.loads(body.decode('utf-8')),
+                         {'data': 'x' * 1000})
+
+
+class ContentCodingSelectionTests(unittest.TestCase):
+
+    def test_that_server_preference_breaks_ties(self):
+        self.assertEqual(content._select_content_coding(
+            'deflate, gzip', ['gzip', 'deflate']), 'gzip')
+
+    def test_that_wildcard_matches_available_codings(self):
+        self.assertEqual(content._select_content_coding(
+            '*', ['gzip', 'deflate']), 'gzip')
+        self.assertEqual(content._select_content_coding(
+            '*, gzip;q=0', ['gzip', 'deflate']), 'deflate')
+
+    def test_that_explicit_identity_preference_is_honored(self):
+        self.assertIsNone(content._select_content_coding(
+            'identity, gzip;q=0.5', ['gzip']))
+
+    def test_that_missing_header_disables_compression(self):
+        self.assertIsNone(content._select_content_coding('', ['gzip']))
+
+
+class RecordingExecutor(object):
+    """Runs submitted work synchronously and records it."""
+
+    def __init__(self):
+        self.submissions = []
+
+    def submit(self, fn, *args, **kwargs):
+        self.submissions.append(fn)
+        return concurrent.dummy_executor.submit(fn, *args, **kwargs)
+
+
+class AsyncHandler(content.HandlerMixin, web.RequestHandler):
+
+    @gen.coroutine
+    def post(self):
+        body = yield self.get_request_body_async()
+        yield self.send_response_async({'body': body})
+        self.finish()
+
+
+class ExecutorOffloadTests(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        return web.Application([web.url('/', AsyncHandler)])
+
+    def setUp(self):
+        super(ExecutorOffloadTests, self).setUp()
+        self.executor = RecordingExecutor()
+        content.register_text_type('application/json', 'utf-8',
+                                   json.dumps, json.loads,
+                                   executor=self.executor,
+                                   offload_threshold=32)
+        content.register_binary_type('application/msgpack', msgpack.packb,
+                                     msgpack.unpackb)
+
+    def tearDown(self):
+        super(ExecutorOffloadTests, self).tearDown()
+        content.clear_handlers()
+
+    def post(self, body, content_type='application/json',
+             accept='application/json'):
+        return self.fetch('/', method='POST', body=body,
+                          headers={'Content-Type': content_type,
+                                   'Accept': accept})
+
+    def test_that_large_bodies_are_decoded_by_executor(self):
+        body = {'data': 'x' * 64}
+        response = self.post(json.dumps(body).encode('utf-8'))
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json.loads(response.body.decode('utf-8')),
+                         {'body': body})
+        self.assertEqual(self.executor.submissions,
+                         [content._unpack_bytes, content._pack_bytes])
+
+    def test_that_small_bodies_are_decoded_inline(self):
+        response = self.post(b'{}')
+        self.assertEqual(response.code, 200)
+        self.assertEqual(self.executor.submissions, [content._pack_bytes])
+
+    def test_that_types_without_executor_run_inline(self):
+        response = self.post(msgpack.packb({'data': 'x' * 64}),
+                             content_type='application/msgpack',
+                             accept='application/msgpack')
+        self.assertEqual(response.code, 200)
+        self.assertEqual(self.executor.submissions, [])
+
+    def test_that_offloaded_decode_failure_results_in_client_error(self):
+        response = self.post(b'not json' * 10)
+        self.assertEqual(response.code, 400)
+
+
+class ContentHandlerPicklingTests(unittest.TestCase):
+
+    def test_that_executor_is_not_pickled(self):
+        handler = content._ContentHandler('application/json')
+        handler.dict_to_string = json.dumps
+        handler.string_to_dict = json.loads
+        handler.executor = RecordingExecutor()
+        handler.get_content_type_header('utf-8')
+
+        copied = pickle.loads(pickle.dumps(handler))
+        self.assertIsNone(copied.executor)
+        self.assertEqual(copied._content_type_headers, {})
+        self.assertIs(copied.string_to_dict, json.loads)
+        self.assertIsNotNone(handler.executor)
+
+
+class ApplicationRegistryTests(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.registry = content.ContentRegistry()
+        self.registry.register_binary_type('application/msgpack',
+                                           msgpack.packb, msgpack.unpackb)
+        return web.Application([web.url('/', contentneg.HttpbinHandler)],
+                               content_registry=self.registry)
+
+    def setUp(self):
+        super(ApplicationRegistryTests, self).setUp()
+        content.register_text_type('application/json', 'utf-8',
+                                   json.dumps, json.loads)
+
+    def tearDown(self):
+        super(ApplicationRegistryTests, self).tearDown()
+        content.clear_handlers()
+
+    def test_that_application_registry_is_used(self):
+        response = self.fetch('/')
+        self.assertEqual(response.headers['Content-Type'],
+                         'application/msgpack')
+
+    def test_that_default_registry_is_not_used(self):
+        response = self.fetch('/', headers={'Accept': 'application/json'})
+        self.assertEqual(response.code, 406)
+
+    def test_that_clearing_default_registry_does_not_affect_app(self):
+        content.clear_handlers()
+        response = self.fetch('/', headers={'Accept': 'application/msgpack'})
+        self.assertEqual(response.code, 200)
+
+    def test_that_registries_track_negotiation_separately(self):
+        self.fetch('/', headers={'Accept': 'application/msgpack'})
+        self.assertEqual(self.registry.negotiation_cache_info().misses, 1)
+        self.assertEqual(content.negotiation_cache_info().misses, 0)
+
+
+class FrozenRegistryTests(unittest.TestCase):
+
+    def setUp(self):
+        super(FrozenRegistryTests, self).setUp()
+        self.registry = content.ContentRegistry()
+        self.registry.register_text_type('application/json', 'utf-8',
+                                         json.dumps, json.loads)
+        self.registry.register_binary_type('application/msgpack',
+                                           msgpack.packb, msgpack.unpackb)
+        self.registry.register_text_type('text/html', 'utf-8', str, str)
+        self.registry.register_text_type('application/hal+json', 'utf-8',
+                                         json.dumps, json.loads)
+
+    def select(self, accept):
+        result = self.registry._select_response_type(accept)
+        return None if result is None else str(result[0])
+
+    def test_that_frozen_registry_agrees_with_full_negotiation(self):
+        accept_headers = [
+            '*/*',
+            'application/json',
+            'application/msgpack',
+            'Application/JSON',
+            'text/*',
+            'application/*;q=0.5, image/png',
+            'text/html;q=0.9, application/msgpack',
+            'application/hal+json, application/json;q=0.8',
+            'application/json;charset=utf-8',
+            'image/png',
+            'image/*, text/plain',
+            'application/json;q=0',
+            'application/json, application/msgpack',
+            'application/msgpack, application/json',
+            'application/json;q=0.5, application/msgpack;q=0.5',
+            'text/html, application/json, application/msgpack',
+            'application/json, text/html;q=0.9, application/hal+json',
+            'application/*, text/*',
+            'text/*;q=0.8, application/*;q=0.8',
+            'garbage, /json, text/html',
+            'application/json;q=0.5, */*',
+            '*/*, text/html;q=0.1',
+            'text/*, text/plain;q=0',
+            '*/*, application/json;q=0',
+            '*/*;q=0.5, text/*;q=0',
+            'text/*;q=0',
+            'application/*;q=0.2, application/msgpack;q=0.1, '
+            'text/html;q=0.15',
+            'application/*;q=0.9, text/html;q=0.5',
+            'application/json;q=1, application/msgpack;q=1',
+            'application/msgpack;q=1, application/json',
+            'application/json;charset=utf-8, */*;q=0.1',
+            'application/*, application/json;q=0.1, */*',
+        ]
+        expected = [self.select(accept) for accept in accept_headers]
+        self.registry.freeze()
+        self.assertEqual([self.select(accept) for accept in accept_headers],
+                         expected)
+
+    def test_that_frozen_registry_rejects_changes(self):
+        self.registry.freeze()
+        self.assertTrue(self.registry.frozen)
+        with self.assertRaises(RuntimeError):
+            self.registry.register_text_type('text/plain', 'utf-8', str, str)
+        with self.assertRaises(RuntimeError):
+            self.registry.register_binary_type(
+                'application/x-msgpack', msgpack.packb, msgpack.unpackb)
+        with self.assertRaises(RuntimeError):
+            self.registry.clear_handlers()
+        self.assertEqual(len(list(self.registry.content_types)), 4)
+
+    def test_that_frozen_registry_uses_negotiation_cache(self):
+        self.registry.freeze()
+        self.select('application/json')
+        self.select('application/json')
+        info = self.registry.negotiation_cache_info()
+        self.assertEqual((info.hits, info.misses), (1, 1))
+
+
+class DefaultContentTypeTests(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.registry = content.ContentRegistry(
+            default_content_type='Application/MsgPack')
+        self.registry.register_text_type('application/json', 'utf-8',
+                                         json.dumps, json.loads)
+        self.registry.register_binary_type('application/msgpack',
+                                           msgpack.packb, msgpack.unpackb)
+        return web.Application([web.url('/', contentneg.HttpbinHandler)],
+                               content_registry=self.registry)
+
+    def test_that_default_is_used_without_accept_header(self):
+        response = self.fetch('/')
+        self.assertEqual(response.headers['Content-Type'],
+                         'application/msgpack')
+        response = self.fetch('/', headers={'Accept': '*/*'})
+        self.assertEqual(response.headers['Content-Type'],
+                         'application/msgpack')
+        self.assertEqual(self.registry.negotiation_cache_info().misses, 0)
+
+    def test_that_other_accept_headers_are_negotiated(self):
+        response = self.fetch('/', headers={'Accept': 'application/json'})
+        self.assertEqual(response.headers['Content-Type'],
+                         'application/json; charset=utf-8')
+
+    def test_that_clearing_default_restores_negotiation(self):
+        self.registry.default_content_type = None
+        response = self.fetch('/')
+        self.assertEqual(response.headers['Content-Type'],
+                         'application/json; charset=utf-8')
+
+    def test_that_unregistered_default_is_ignored(self):
+        self.registry.default_content_type = 'application/yaml'
+        response = self.fetch('/')
+        self.assertEqual(response.headers['Content-Type'],
+                         'application/json; charset=utf-8')
+
+    def test_that_default_is_normalized(self):
+        self.assertEqual(self.registry.default_content_type,
+                         'application/msgpack')
+
+    def test_that_default_cannot_change_after_freezing(self):
+        self.registry.freeze()
+        with self.assertRaises(RuntimeError):
+            self.registry.default_content_type = 'application/json'
+        response = self.fetch('/')
+        self.assertEqual(response.headers['Content-Type'],
+                         'application/msgpack')
+
+
+class MsgpackRecordLoader(object):
+    """Adapts :class:`msgpack.Unpacker` to the record interface."""
+
+    def __init__(self):
+        self.unpacker = msgpack.Unpacker()
+
+    def feed(self, data):
+        self.unpacker.feed(data)
+        return list(self.unpacker)
+
+    def close(self):
+        return []
+
+
+class RecordHandler(content.HandlerMixin, web.RequestHandler):
+    record_chunk_size = 16
+
+    def post(self):
+        records = []
+        for record in self.get_request_records():
+            records.append(record)
+        self.send_response({'records': records})
+        self.finish()
+
+
+@web.stream_request_body
+class StreamingRecordHandler(content.StreamingHandlerMixin, RecordHandler):
+    pass
+
+
+class RequestRecordTests(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        return web.Application([web.url('/', RecordHandler),
+                                web.url('/stream', StreamingRecordHandler)])
+
+    def get_httpserver_options(self):
+        return {'chunk_size': 8}
+
+    def setUp(self):
+        super(RequestRecordTests, self).setUp()
+        content.register_text_type(
+            'application/json', 'utf-8', json.dumps, json.loads,
+            incremental_loader=RecordingJsonLoader)
+        content.register_text_type(
+            'application/x-ndjson', 'utf-8', json.dumps, json.loads,
+            record_loader=content.line_records(json.loads))
+        content.register_binary_type('application/msgpack', msgpack.packb,
+                                     msgpack.unpackb,
+                                     record_loader=MsgpackRecordLoader)
+
+    def tearDown(self):
+        super(RequestRecordTests, self).tearDown()
+        content.clear_handlers()
+
+    def post_records(self, path, content_type, body):
+        response = self.fetch(path, method='POST', body=body,
+                              headers={'Content-Type': content_type,
+                                       'Accept': 'application/json'})
+        self.assertEqual(response.code, 200)
+        return json.loads(response.body.decode('utf-8'))['records']
+
+    def test_that_text_records_are_decoded(self):
+        records = [{'id': index, 'name': KOREAN_TEXT[:index]}
+                   for index in range(10)]
+        body = '\n'.join(json.dumps(record, ensure_ascii=False)
+                         for record in records).encode('utf-8')
+        for path in ('/', '/stream'):
+            self.assertEqual(
+                self.post_records(path, 'application/x-ndjson', body),
+                records)
+
+    def test_that_binary_records_are_decoded(self):
+        records = [{'id': index, 'name': 'x' * index} for index in range(10)]
+        body = b''.join(msgpack.packb(record) for record in records)
+        for path in ('/', '/stream'):
+            self.assertEqual(
+                self.post_records(path, 'application/msgpack', body),
+                records)
+
+    def test_that_list_body_is_used_without_record_loader(self):
+        records = [{'id': index} for index in range(3)]
+        body = json.dumps(records).encode('utf-8')
+        for path in ('/', '/stream'):
+            self.assertEqual(
+                self.post_records(path, 'application/json', body), records)
+        self.assertEqual(
+            self.post_records('/', 'application/json', b'{"id": 1}'),
+            [{'id': 1}])
+
+    def test_that_record_decode_failure_results_in_client_error(self):
+        response = self.fetch('/', method='POST', body=b'{"id": 1}\nnot json',
+                              headers={'Content-Type': 'application/x-ndjson'})
+        self.assertEqual(response.code, 400)
+
+    def test_that_unknown_content_type_results_in_unsupp_media_type(self):
+        response = self.fetch('/', method='POST', body=b'<records/>',
+                              headers={'Content-Type': 'application/xml'})
+        self.assertEqual(response.code, 415)
+
+
+class LineRecordsTests(unittest.TestCase):
+
+    def test_that_records_are_returned_as_lines_complete(self):
+        loader = content.line_records(json.loads)()
+        self.assertEqual(loader.feed('{"id": 1}\n{"i'), [{'id': 1}])
+        self.assertEqual(loader.feed('d": 2}\n\n'), [{'id': 2}])
+        self.assertEqual(loader.feed('{"id": 3}'), [])
+        self.assertEqual(loader.close(), [{'id': 3}])
+
+    def test_that_blank_lines_are_ignored(self):
+        loader = content.line_records(json.loads)()
+        self.assertEqual(loader.feed('\r\n  \n'), [])
+        self.assertEqual(loader.close(), [])
+
+
+class ResponseCacheTests(unittest.TestCase):
+
+    def test_that_entries_are_retrieved_by_key(self):
+        cache = content.ResponseCache()
+        entry = cache.put(('key', 'application/json', 'utf-8'), 'utf-8',
+                          b'{}')
+        self.assertIs(cache.get(('key', 'application/json', 'utf-8')), entry)
+        self.assertIsNone(cache.get(('key', 'application/json', 'latin1')))
+        self.assertEqual(entry.etag,
+                         '"bf21a9e8fbc5a3846fb05b4fa0859e0917b2202f"')
+        self.assertEqual(cache.info(), content.CacheInfo(1, 1, 16777216, 2))
+
+    def test_that_least_recently_used_entries_are_evicted(self):
+        cache = content.ResponseCache(maxbytes=10)
+        cache.put(('one', 'text/plain', None), None, b'1111')
+        cache.put(('two', 'text/plain', None), None, b'2222')
+        cache.get(('one', 'text/plain', None))
+        cache.put(('three', 'text/plain', None), None, b'3333')
+        self.assertIsNotNone(cache.get(('one', 'text/plain', None)))
+        self.assertIsNone(cache.get(('two', 'text/plain', None)))
+        self.assertIsNotNone(cache.get(('three', 'text/plain', None)))
+        self.assertEqual(cache.info().currsize, 8)
+
+    def test_that_oversized_entries_are_not_stored(self):
+        cache = content.ResponseCache(maxbytes=2)
+        entry = cache.put(('big', 'text/plain', None), None, b'big')
+        self.assertIsNotNone(entry.etag)
+        self.assertIsNone(cache.get(('big', 'text/plain', None)))
+        self.assertEqual(cache.info().currsize, 0)
+
+    def test_that_invalidate_discards_every_variant(self):
+        cache = content.ResponseCache()
+        cache.put(('key', 'application/json', 'utf-8'), 'utf-8', b'{}')
+        cache.put(('key', 'application/msgpack', None), None, b'\x80')
+        cache.put(('other', 'application/json', 'utf-8'), 'utf-8', b'[]')
+        cache.invalidate('key')
+        self.assertIsNone(cache.get(('key', 'application/json', 'utf-8')))
+        self.assertIsNone(cache.get(('key', 'application/msgpack', None)))
+        self.assertIsNotNone(cache.get(('other', 'application/json',
+                                        'utf-8')))
+        self.assertEqual(cache.info().currsize, 2)
+
+
+class CachingHandler(content.HandlerMixin, web.RequestHandler):
+    response_cache = None
+
+    def get(self):
+        self.send_response({'status': 'ok'},
+                           cache_key=self.get_query_argument('key', None))
+        self.finish()
+
+    put = get
+
+
+class CachingAsyncHandler(CachingHandler):
+
+    @gen.coroutine
+    def get(self):
+        yield self.send_response_async({'status': 'ok'}, cache_key='async')
+        self.finish()
+
+
+class CompressingCachingHandler(CachingHandler):
+    compress_responses = True
+    compression_threshold = 0
+
+
+class CachedResponseTests(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.dumps_calls = []
+
+        def dumps(obj):
+            self.dumps_calls.append(obj)
+            return json.dumps(obj)
+
+        registry = content.ContentRegistry()
+        registry.register_text_type('application/json', 'utf-8',
+                                    dumps, json.loads)
+        return web.Application([web.url('/', CachingHandler),
+                                web.url('/async', CachingAsyncHandler),
+                                web.url('/gzip', CompressingCachingHandler)],
+                               content_registry=registry)
+
+    def setUp(self):
+        super(CachedResponseTests, self).setUp()
+        CachingHandler.response_cache = content.ResponseCache()
+
+    def tearDown(self):
+        super(CachedResponseTests, self).tearDown()
+        CachingHandler.response_cache = None
+
+    def test_that_cached_response_is_not_encoded_again(self):
+        first = self.fetch('/?key=status')
+        second = self.fetch('/?key=status')
+        self.assertEqual(first.body, second.body)
+        self.assertEqual(first.headers['Etag'], second.headers['Etag'])
+        self.assertEqual(second.headers['Content-Type'],
+                         'application/json; charset=utf-8')
+        self.assertEqual(len(self.dumps_calls), 1)
+
+        self.fetch('/async')
+        self.fetch('/async')
+        self.assertEqual(len(self.dumps_calls), 2)
+
+    def test_that_responses_without_key_are_not_cached(self):
+        self.fetch('/')
+        self.fetch('/')
+        self.assertEqual(len(self.dumps_calls), 2)
+        self.assertEqual(CachingHandler.response_cache.info().currsize, 0)
+
+    def test_that_matching_if_none_match_results_in_not_modified(self):
+        etag = self.fetch('/?key=status').headers['Etag']
+        response = self.fetch('/?key=status',
+                              headers={'If-None-Match': etag})
+        self.assertEqual(response.code, 304)
+        self.assertEqual(response.body, b'')
+        self.assertEqual(len(self.dumps_calls), 1)
+
+        response = self.fetch('/?key=status',
+                              headers={'If-None-Match': '"other"'})
+        self.assertEqual(response.code, 200)
+
+    def test_that_if_none_match_is_ignored_for_unsafe_methods(self):
+        etag = self.fetch('/?key=status').headers['Etag']
+        for if_none_match in (etag, '*'):
+            response = self.fetch('/?key=status', method='PUT', body=b'',
+                                  headers={'If-None-Match': if_none_match})
+            self.assertEqual(response.code, 200)
+            self.assertEqual(json.loads(response.body.decode('utf-8')),
+                             {'status': 'ok'})
+
+    def test_that_content_coding_is_included_in_etag(self):
+        plain = self.fetch('/gzip?key=status', decompress_response=False,
+                           headers={'Accept-Encoding': 'identity'})
+        compressed = self.fetch('/gzip?key=status', decompress_response=False,
+                                headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(compressed.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(compressed.headers['Etag'],
+                         plain.headers['Etag'][:-1] + '-gzip"')
+        self.assertEqual(len(self.dumps_calls), 1)
+
+        response = self.fetch(
+            '/gzip?key=status', decompress_response=False,
+            headers={'Accept-Encoding': 'gzip',
+                     'If-None-Match': compressed.headers['Etag']})
+        self.assertEqual(response.code, 304)
+        self.assertEqual(response.headers['Vary'], 'Accept-Encoding')
+
+
+class RecordingMetrics(content.ContentMetrics):
+
+    def __init__(self):
+        super(RecordingMetrics, self).__init__()
+        self.calls = []
+
+    def negotiated(self, content_type, elapsed):
+        self.calls.append(('negotiated', content_type))
+        assert elapsed >= 0.0
+
+    def decoded(self, content_type, num_bytes, elapsed):
+        self.calls.append(('decoded', content_type, num_bytes))
+        assert elapsed >= 0.0
+
+    def encoded(self, content_type, num_bytes, elapsed):
+        self.calls.append(('encoded', content_type, num_bytes))
+        assert elapsed >= 0.0
+
+    def limit_exceeded(self, content_type, limit):
+        self.calls.append(('limit_exceeded', content_type, limit))
+
+
+class ContentMetricsTests(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.metrics = RecordingMetrics()
+        registry = content.ContentRegistry(metrics=self.metrics)
+        registry.register_text_type('application/json', 'utf-8',
+                                    json.dumps, json.loads,
+                                    incremental_loader=RecordingJsonLoader,
+                                    stream_dumper=json_array_dumper)
+        return web.Application([
+            web.url('/', AsyncHandler),
+            web.url('/stream', StreamingResponseHandler),
+            web.url('/upload', StreamingHandler),
+        ], content_registry=registry)
+
+    def setUp(self):
+        super(ContentMetricsTests, self).setUp()
+        RecordingJsonLoader.chunks = []
+
+    def test_that_decode_and_encode_are_recorded(self):
+        response = self.fetch('/', method='POST', body=b'{"one":1}',
+                              headers={'Content-Type': 'application/json'})
+        self.assertEqual(self.metrics.calls, [
+            ('decoded', 'application/json', 9),
+            ('negotiated', 'application/json'),
+            ('encoded', 'application/json', len(response.body)),
+        ])
+
+    def test_that_streamed_response_is_recorded(self):
+        response = self.fetch('/stream?count=50')
+        self.assertEqual(self.metrics.calls, [
+            ('negotiated', 'application/json'),
+            ('encoded', 'application/json', len(response.body)),
+        ])
+
+    def test_that_streamed_request_is_recorded(self):
+        self.fetch('/upload', method='POST', body=b'{"one":1}',
+                   headers={'Content-Type': 'application/json'})
+        self.assertEqual(self.metrics.calls[0],
+                         ('decoded', 'application/json', 9))
+
+
+class RequestLimitTests(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.metrics = RecordingMetrics()
+        self.registry = content.ContentRegistry(metrics=self.metrics)
+        self.registry.register_text_type(
+            'application/json', 'utf-8', json.dumps, json.loads,
+            incremental_loader=RecordingJsonLoader,
+            record_loader=content.line_records(json.loads))
+        self.registry.set_request_limits('application/json',
+                                         max_body_size=64, max_depth=3,
+                                         max_elements=5)
+        return web.Application([web.url('/', contentneg.HttpbinHandler),
+                                web.url('/async', AsyncHandler),
+                                web.url('/records', RecordHandler),
+                                web.url('/stream', CountingStreamingHandler)],
+                               content_registry=self.registry)
+
+    def get_httpserver_options(self):
+        return {'chunk_size': 1024}
+
+    def setUp(self):
+        super(RequestLimitTests, self).setUp()
+        RecordingJsonLoader.chunks = []
+        CountingStreamingHandler.chunks = []
+
+    def post(self, path, body):
+        return self.fetch(path, method='POST', body=body,
+                          headers={'Content-Type': 'application/json'})
+
+    def test_that_bodies_within_limits_are_decoded(self):
+        for path in ('/', '/async', '/stream'):
+            response = self.post(path, b'{"one": [1, {"two": 2}]}')
+            self.assertEqual(response.code, 200)
+        self.assertNotIn('limit_exceeded',
+                         [call[0] for call in self.metrics.calls])
+
+    def test_that_large_body_is_rejected_before_decoding(self):
+        body = json.dumps({'name': 'x' * 64}).encode('utf-8')
+        for path in ('/', '/async', '/records', '/stream'):
+            response = self.post(path, body)
+            self.assertEqual(response.code, 413)
+        self.assertEqual(RecordingJsonLoader.chunks, [])
+        self.assertEqual(
+            [call for call in self.metrics.calls
+             if call[0] in ('decoded', 'limit_exceeded')],
+            [('limit_exceeded', 'application/json', 'max_body_size')] * 4)
+
+        response = self.fetch('/stream', method='POST',
+                              body=b'[' + b'1,' * 100000 + b'1]',
+                              expect_100_continue=True,
+                              headers={'Content-Type': 'application/json'})
+        self.assertEqual(response.code, 413)
+        self.assertEqual(CountingStreamingHandler.chunks, [])
+
+    def test_that_deeply_nested_body_is_rejected(self):
+        for path in ('/', '/async', '/records', '/stream'):
+            response = self.post(path, b'[[[[1]]]]')
+            self.assertEqual(response.code, 413)
+        self.assertEqual(
+            self.metrics.calls[-1],
+            ('limit_exceeded', 'application/json', 'max_depth'))
+
+    def test_that_body_with_many_elements_is_rejected(self):
+        for path in ('/', '/async', '/stream'):
+            response = self.post(path, b'{"a": [1, 2, 3], "b": [4]}')
+            self.assertEqual(response.code, 413)
+        self.assertEqual(
+            self.metrics.calls[-1],
+            ('limit_exceeded', 'application/json', 'max_elements'))
+
+    def test_that_limits_apply_to_each_record(self):
+        response = self.post('/records', b'[1, 2, 3]\n[4, 5, 6]')
+        self.assertEqual(response.code, 200)
+        response = self.post('/records', b'[1, 2]\n[[[[3]]]]')
+        self.assertEqual(response.code, 413)
+
+    def test_that_limits_require_registered_type(self):
+        with self.assertRaises(ValueError):
+            self.registry.set_request_limits('application/xml',
+                                             max_body_size=1)
+
+
+class Point(object):
+    __slots__ = ('x', 'y')
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+
+def typed_json_loader(text, body_type):
+    typed_json_loader.calls.append(body_type)
+    obj = json.loads(text)
+    try:
+        body = body_type(**obj)
+    except TypeError as error:
+        raise ValueError(str(error))
+    for name in body_type.__slots__:
+        if not isinstance(obj[name], int):
+            raise ValueError('{0} is not an integer'.format(name))
+    return body
+
+
+typed_json_loader.calls = []
+
+
+class TypedHandler(content.HandlerMixin, web.RequestHandler):
+    request_body_type = Point
+
+    def post(self):
+        body = self.get_request_body()
+        self.send_response({'type': type(body).__name__,
+                            'x': body.x, 'y': body.y})
+        self.finish()
+
+
+class TypedAsyncHandler(TypedHandler):
+
+    @gen.coroutine
+    def post(self):
+        body = yield self.get_request_body_async()
+        self.send_response({'type': type(body).__name__,
+                            'x': body.x, 'y': body.y})
+        self.finish()
+
+
+@web.stream_request_body
+class TypedStreamingHandler(content.StreamingHandlerMixin, TypedHandler):
+    pass
+
+
+class TypedRequestBodyTests(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.registry = content.ContentRegistry()
+        self.registry.register_text_type('application/json', 'utf-8',
+                                         json.dumps, json.loads,
+                                         typed_loader=typed_json_loader)
+        self.registry.register_binary_type(
+            'application/msgpack', msgpack.packb,
+            functools.partial(msgpack.unpackb, raw=False),
+            incremental_loader=MsgpackLoader)
+        return web.Application([web.url('/', TypedHandler),
+                                web.url('/async', TypedAsyncHandler),
+                                web.url('/stream', TypedStreamingHandler)],
+                               content_registry=self.registry)
+
+    def setUp(self):
+        super(TypedRequestBodyTests, self).setUp()
+        typed_json_loader.calls = []
+
+    def post(self, path, content_type, body):
+        response = self.fetch(path, method='POST', body=body,
+                              headers={'Content-Type': content_type,
+                                       'Accept': 'application/json'})
+        if response.code == 200:
+            return json.loads(response.body.decode('utf-8'))
+        return response.code
+
+    def test_that_typed_loader_creates_body(self):
+        for path in ('/', '/async', '/stream'):
+            self.assertEqual(
+                self.post(path, 'application/json', b'{"x": 1, "y": 2}'),
+                {'type': 'Point', 'x': 1, 'y': 2})
+        self.assertEqual(typed_json_loader.calls, [Point] * 3)
+
+    def test_that_body_is_converted_without_typed_loader(self):
+        for path in ('/', '/async', '/stream'):
+            self.assertEqual(
+                self.post(path, 'application/msgpack',
+                          msgpack.packb({'x': 1, 'y': 2})),
+                {'type': 'Point', 'x': 1, 'y': 2})
+
+    def test_that_typed_loader_validates_with_size_limit(self):
+        self.registry.set_request_limits('application/json',
+                                         max_body_size=32)
+        for path in ('/', '/async', '/stream'):
+            self.assertEqual(
+                self.post(path, 'application/json',
+                          b'{"x": 1, "y": "lots"}'),
+                400)
+            self.assertEqual(
+                self.post(path, 'application/json',
+                          b'{"x": 1, "y": 2, "padding": "..........."}'),
+                413)
+            self.assertEqual(
+                self.post(path, 'application/json', b'{"x": 1, "y": 2}'),
+                {'type': 'Point', 'x': 1, 'y': 2})
+        self.assertEqual(typed_json_loader.calls, [Point] * 6)
+
+    def test_that_structure_limits_are_rejected_with_typed_loader(self):
+        with self.assertRaises(ValueError):
+            self.registry.set_request_limits('application/json',
+                                             max_depth=2)
+        with self.assertRaises(ValueError):
+            self.registry.set_request_limits('application/json',
+                                             max_elements=10)
+        self.registry.set_request_limits('application/msgpack',
+                                         max_depth=2)
+        with self.assertRaises(ValueError):
+            self.registry.register_binary_type(
+                'application/msgpack', msgpack.packb, msgpack.unpackb,
+                typed_loader=typed_json_loader)
+
+    def test_that_mismatched_body_results_in_client_error(self):
+        for path in ('/', '/async', '/stream'):
+            self.assertEqual(
+                self.post(path, 'application/json', b'{"x": 1}'), 400)
+            self.assertEqual(
+                self.post(path, 'application/msgpack',
+                          msgpack.packb({'x': 1, 'z': 2})), 400)
+            self.assertEqual(
+                self.post(path, 'application/msgpack',
+                          msgpack.packb([1, 2])), 400)
+
+
+class RecordingLogHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class DebugLoggingTests(unittest.TestCase):
+
+    def setUp(self):
+        super(DebugLoggingTests, self).setUp()
+        self.log_handler = RecordingLogHandler()
+        self.original_level = content.LOGGER.level
+        content.LOGGER.addHandler(self.log_handler)
+        self.handler = content._ContentHandler('application/json')
+        self.handler.string_to_dict = json.loads
+
+    def tearDown(self):
+        super(DebugLoggingTests, self).tearDown()
+        content.LOGGER.removeHandler(self.log_handler)
+        content.LOGGER.setLevel(self.original_level)
+
+    @unittest.skipUnless(__debug__, 'debug logging is removed by -O')
+    def test_that_debug_records_include_structured_fields(self):
+        content.LOGGER.setLevel(logging.DEBUG)
+        self.handler.unpack_bytes(b'{}', encoding='utf-8')
+        record = self.log_handler.records[-1]
+        self.assertEqual(record.content_type, 'application/json')
+        self.assertEqual(record.num_bytes, 2)
+        self.assertEqual(record.encoding, 'utf-8')
+
+    def test_that_nothing_is_logged_when_debug_is_disabled(self):
+        content.LOGGER.setLevel(logging.INFO)
+        self.handler.unpack_bytes(b'{}', encoding='utf-8')
+        self.assertEqual(self.log_handler.records, [])
@@ -1,6 +1,9 @@
+import json
+import time
 import unittest
 
 from tornado import httpclient
+import tornado.gen
 import tornado.testing
 
 from glinda import httpcompat
@@ -150,3 +153,358 @@ class RequestRecordingTests(tornado.testing.AsyncTestCase):
         with self.assertRaises(AssertionError):
             service.assert_request('GET', '/resource', foo='bar')
         service.assert_request('POST', '/resource', foo='bar')
+
+
+class ResponseSequenceTests(tornado.testing.AsyncTestCase):
+
+    def setUp(self):
+        super(ResponseSequenceTests, self).setUp()
+        self.service_layer = services.ServiceLayer()
+        self.service = self.service_layer['service']
+        self.client = httpclient.AsyncHTTPClient()
+
+    @tornado.gen.coroutine
+    def fetch_codes(self, count):
+        codes = []
+        for _ in range(count):
+            response = yield self.client.fetch(
+                self.service.url_for('/resource'), raise_error=False)
+            codes.append(response.code)
+        raise tornado.gen.Return(codes)
+
+    @tornado.testing.gen_test
+    def test_that_responses_are_returned_in_order(self):
+        self.service.add_responses(
+            services.Request('GET', '/resource'),
+            (services.Response(200 + index) for index in range(3)))
+        codes = yield self.fetch_codes(4)
+        self.assertEqual(codes, [200, 201, 202, 456])
+
+    @tornado.testing.gen_test
+    def test_that_response_is_repeated_requested_times(self):
+        request = services.Request('GET', '/resource')
+        self.service.add_response(request, services.Response(201), times=2)
+        self.service.add_response(request, services.Response(202))
+        codes = yield self.fetch_codes(4)
+        self.assertEqual(codes, [201, 201, 202, 456])
+
+    @tornado.testing.gen_test
+    def test_that_response_is_repeated_forever(self):
+        self.service.add_response(services.Request('GET', '/resource'),
+                                  services.Response(204), times=None)
+        codes = yield self.fetch_codes(5)
+        self.assertEqual(codes, [204] * 5)
+
+    def test_that_times_must_be_positive(self):
+        with self.assertRaises(ValueError):
+            self.service.add_response(services.Request('GET', '/resource'),
+                                      services.Response(200), times=0)
+
+
+class ResourceTableTests(unittest.TestCase):
+
+    def setUp(self):
+        super(ResourceTableTests, self).setUp()
+        self.table = services._ResourceTable()
+
+    def test_that_literal_resources_are_found(self):
+        self.table.add('/resource', 'service')
+        self.assertEqual(self.table.find('/resource'),
+                         ('service', '/resource'))
+        self.assertIsNone(self.table.find('/resource/child'))
+
+    def test_that_template_segments_match_any_segment(self):
+        self.table.add('/users/{id}/groups', 'service')
+        self.assertEqual(self.table.find('/users/1/groups'),
+                         ('service', '/users/{id}/groups'))
+        self.assertIsNone(self.table.find('/users/1'))
+        self.assertIsNone(self.table.find('/users/1/groups/2'))
+
+    def test_that_template_segments_do_not_match_empty_segments(self):
+        self.table.add('/users/{id}', 'service')
+        self.table.add('/groups/{id}/members', 'service')
+        self.assertIsNone(self.table.find('/users/'))
+        self.assertIsNone(self.table.find('/groups//members'))
+        self.assertEqual(self.table.find('/users/1'),
+                         ('service', '/users/{id}'))
+
+    def test_that_literal_segments_are_preferred(self):
+        self.table.add('/users/{id}/groups', 'template')
+        self.table.add('/users/me/{name}', 'literal')
+        self.assertEqual(self.table.find('/users/me/groups'),
+                         ('literal', '/users/me/{name}'))
+        self.assertEqual(self.table.find('/users/you/groups'),
+                         ('template', '/users/{id}/groups'))
+
+    def test_that_literal_search_backtracks_to_templates(self):
+        self.table.add('/users/{id}/groups', 'template')
+        self.table.add('/users/me/profile', 'literal')
+        self.assertEqual(self.table.find('/users/me/groups'),
+                         ('template', '/users/{id}/groups'))
+
+
+class TemplateResourceTests(tornado.testing.AsyncTestCase):
+
+    def setUp(self):
+        super(TemplateResourceTests, self).setUp()
+        self.service_layer = services.ServiceLayer()
+        self.service = self.service_layer['service']
+        self.client = httpclient.AsyncHTTPClient()
+
+    def test_that_template_segments_are_not_quoted(self):
+        request = services.Request('GET', '/users/{id}', 'a b')
+        self.assertEqual(request.resource, '/users/{id}/a%20b')
+
+    @tornado.testing.gen_test
+    def test_that_template_resource_responds(self):
+        self.service.add_responses(
+            services.Request('GET', '/users/{id}'),
+            [services.Response(201), services.Response(202)])
+        first = yield self.client.fetch(self.service.url_for('users', '1'))
+        second = yield self.client.fetch(self.service.url_for('users', '2'))
+        self.assertEqual([first.code, second.code], [201, 202])
+        self.assertEqual(self.service.get_request('users', '2').resource,
+                         '/users/2')
+
+    @tornado.testing.gen_test
+    def test_that_literal_resource_is_preferred(self):
+        self.service.add_response(services.Request('GET', '/users/{id}'),
+                                  services.Response(201))
+        self.service.add_response(services.Request('GET', '/users/me'),
+                                  services.Response(202))
+        response = yield self.client.fetch(self.service.url_for('users/me'))
+        self.assertEqual(response.code, 202)
+
+    @tornado.testing.gen_test
+    def test_that_unknown_resources_are_not_found(self):
+        self.service.add_endpoint('/users/{id}')
+        response = yield self.client.fetch(
+            self.service.url_for('users', '1', 'groups'), raise_error=False)
+        self.assertEqual(response.code, 404)
+
+
+class ServiceIsolationTests(tornado.testing.AsyncTestCase):
+
+    def setUp(self):
+        super(ServiceIsolationTests, self).setUp()
+        self.service_layer = services.ServiceLayer()
+        self.client = httpclient.AsyncHTTPClient()
+
+    @tornado.testing.gen_test
+    def test_that_services_do_not_share_resources(self):
+        first = self.service_layer['first']
+        second = self.service_layer['second']
+        first.add_response(services.Request('GET', '/resource'),
+                           services.Response(201))
+        second.add_response(services.Request('GET', '/resource'),
+                            services.Response(202))
+
+        response = yield self.client.fetch(second.url_for('/resource'))
+        self.assertEqual(response.code, 202)
+        response = yield self.client.fetch(first.url_for('/resource'))
+        self.assertEqual(response.code, 201)
+        first.get_request('/resource')
+        second.get_request('/resource')
+
+    @tornado.testing.gen_test
+    def test_that_resources_are_not_visible_to_other_services(self):
+        first = self.service_layer['first']
+        second = self.service_layer['second']
+        first.add_response(services.Request('GET', '/resource'),
+                           services.Response(201))
+
+        response = yield self.client.fetch(second.url_for('/resource'),
+                                           raise_error=False)
+        self.assertEqual(response.code, 404)
+        with self.assertRaises(AssertionError):
+            first.get_request('/resource')
+
+
+class ProcessServiceLayerTests(tornado.testing.AsyncTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(ProcessServiceLayerTests, cls).setUpClass()
+        cls.service_layer = services.ProcessServiceLayer(processes=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.service_layer.close()
+        super(ProcessServiceLayerTests, cls).tearDownClass()
+
+    def setUp(self):
+        super(ProcessServiceLayerTests, self).setUp()
+        self.client = httpclient.AsyncHTTPClient()
+
+    def test_that_services_are_cached(self):
+        self.assertIs(self.service_layer['cached'],
+                      self.service_layer.get_service('cached'))
+
+    def test_that_processes_must_be_positive(self):
+        with self.assertRaises(ValueError):
+            services.ProcessServiceLayer(processes=0)
+
+    @tornado.testing.gen_test
+    def test_that_remote_service_responds(self):
+        first = self.service_layer['respond-first']
+        second = self.service_layer['respond-second']
+        self.assertNotEqual(first.host, second.host)
+        first.add_response(services.Request('GET', '/resource'),
+                           services.Response(201), times=2)
+        second.add_responses(
+            services.Request('GET', '/resource'),
+            (services.Response(202 + index) for index in range(2)))
+
+        codes = []
+        for service in (first, second, first, second, first):
+            response = yield self.client.fetch(
+                service.url_for('/resource'), raise_error=False)
+            codes.append(response.code)
+        self.assertEqual(codes, [201, 202, 201, 203, 456])
+
+    @tornado.testing.gen_test
+    def test_that_remote_requests_are_recorded(self):
+        service = self.service_layer['record']
+        service.add_response(services.Request('POST', '/resource'),
+                             services.Response(200))
+        yield self.client.fetch(service.url_for('/resource', arg='value'),
+                                method='POST', body='BODY',
+                                headers={'Custom': 'Header'})
+
+        request = service.get_request('/resource')
+        self.assertEqual(request.method, 'POST')
+        self.assertEqual(request.query, {'arg': 'value'})
+        self.assertEqual(request.body, b'BODY')
+        self.assertEqual(request.headers['Custom'], 'Header')
+        service.assert_request('POST', '/resource', arg='value')
+
+    @tornado.testing.gen_test
+    def test_that_remote_network_conditions_are_used(self):
+        service = self.service_layer['conditions']
+        service.set_network_conditions(delay=0.2)
+        service.add_response(services.Request('GET', '/resource'),
+                             services.Response(200))
+        start = time.time()
+        yield self.client.fetch(service.url_for('/resource'))
+        self.assertGreaterEqual(time.time() - start, 0.2)
+
+    def test_that_remote_errors_are_raised(self):
+        service = self.service_layer['errors']
+        with self.assertRaises(AssertionError):
+            service.get_request('/resource')
+        with self.assertRaises(AssertionError):
+            service.assert_request('GET', '/resource')
+        with self.assertRaises(ValueError):
+            service.add_response(services.Request('GET', '/resource'),
+                                 services.Response(200), times=0)
+
+
+class NetworkConditionTests(tornado.testing.AsyncTestCase):
+
+    def setUp(self):
+        super(NetworkConditionTests, self).setUp()
+        self.service_layer = services.ServiceLayer()
+        self.service = self.service_layer['service']
+        self.client = httpclient.AsyncHTTPClient()
+
+    @tornado.gen.coroutine
+    def timed_fetch(self, **kwargs):
+        start = time.time()
+        response = yield self.client.fetch(
+            self.service.url_for('/resource'), raise_error=False, **kwargs)
+        raise tornado.gen.Return((response, time.time() - start))
+
+    def test_that_invalid_conditions_are_rejected(self):
+        with self.assertRaises(ValueError):
+            services.Response(200, failure='explode')
+        with self.assertRaises(ValueError):
+            services.Response(200, bytes_per_second=0)
+        with self.assertRaises(ValueError):
+            self.service.set_network_conditions(failure='explode')
+
+    def test_that_response_conditions_override_service_conditions(self):
+        self.service.set_network_conditions(delay=1, bytes_per_second=10,
+                                            failure=services.Response.RESET)
+        conditions = self.service.get_network_conditions(
+            services.Response(200, delay=2, failure=services.Response.TIMEOUT))
+        self.assertEqual(conditions, (2, 10, services.Response.TIMEOUT))
+
+        self.service.set_network_conditions()
+        conditions = self.service.get_network_conditions(
+            services.Response(200))
+        self.assertEqual(conditions, (0, None, None))
+
+    def test_that_jitter_is_added_to_delay(self):
+        response = services.Response(200, delay=1, jitter=lambda: 0.5)
+        self.assertEqual(self.service.get_network_conditions(response)[0],
+                         1.5)
+        for _ in range(10):
+            delay = self.service.get_network_conditions(
+                services.Response(200, delay=1, jitter=0.25))[0]
+            self.assertTrue(1 <= delay <= 1.25, delay)
+
+    @tornado.testing.gen_test
+    def test_that_response_is_delayed(self):
+        self.service.add_response(services.Request('GET', '/resource'),
+                                  services.Response(200, delay=0.2))
+        response, elapsed = yield self.timed_fetch()
+        self.assertEqual(response.code, 200)
+        self.assertGreaterEqual(elapsed, 0.2)
+
+    @tornado.testing.gen_test
+    def test_that_service_delay_does_not_block_other_requests(self):
+        slow = self.service_layer['slow']
+        slow.set_network_conditions(delay=0.5)
+        slow.add_response(services.Request('GET', '/resource'),
+                          services.Response(200))
+        self.service.add_response(services.Request('GET', '/resource'),
+                                  services.Response(200))
+
+        slow_future = self.client.fetch(slow.url_for('/resource'))
+        response, elapsed = yield self.timed_fetch()
+        self.assertLess(elapsed, 0.5)
+        response = yield slow_future
+        self.assertEqual(response.code, 200)
+
+    @tornado.testing.gen_test
+    def test_that_body_is_throttled(self):
+        self.service.add_response(
+            services.Request('GET', '/resource'),
+            services.Response(200, body=b'x' * 1000, bytes_per_second=4000))
+        response, elapsed = yield self.timed_fetch()
+        self.assertEqual(response.body, b'x' * 1000)
+        self.assertEqual(response.headers['Content-Length'], '1000')
+        self.assertGreaterEqual(elapsed, 0.2)
+
+    @tornado.testing.gen_test
+    def test_that_throttled_dict_body_is_encoded(self):
+        self.service.add_response(
+            services.Request('GET', '/resource'),
+            services.Response(200, body={'key': 'value'},
+                              bytes_per_second=4000))
+        response, _ = yield self.timed_fetch()
+        self.assertEqual(json.loads(response.body.decode('utf-8')),
+                         {'key': 'value'})
+        self.assertEqual(response.headers['Content-Type'],
+                         'application/json; charset=UTF-8')
+
+    @tornado.testing.gen_test
+    def test_that_connection_is_reset(self):
+        self.service.add_response(
+            services.Request('GET', '/resource'),
+            services.Response(200, failure=services.Response.RESET))
+        with self.assertRaises((IOError, httpclient.HTTPError)):
+            yield self.client.fetch(self.service.url_for('/resource'))
+        self.service.get_request('/resource')
+
+    @tornado.testing.gen_test
+    def test_that_connection_times_out(self):
+        self.service.add_response(
+            services.Request('GET', '/resource'),
+            services.Response(200, failure=services.Response.TIMEOUT))
+        start = time.time()
+        with self.assertRaises(httpclient.HTTPError) as context:
+            yield self.client.fetch(self.service.url_for('/resource'),
+                                    request_timeout=0.2)
+        self.assertEqual(context.exception.code, 599)
+        self.assertGreaterEqual(time.time() - start, 0.2)